@@ -3,37 +3,58 @@
 RetailStack POS Agent - Desktop App with Web UI
 """
 
-import sys
 import os
 import logging
+import functools
+import gzip
+import hashlib
 from pathlib import Path
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
 import threading
 import json
-
-# Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+import queue
+import sqlite3
+import time
+from datetime import datetime, timedelta
 
 from src.escpos_parser import ESCPOSParser
 from src.transaction_buffer import TransactionBuffer
 from src.gap_detector import GapDetector
-from src.printer_interceptor import PrinterInterceptor
-from src.sync_client import SyncClient, StubSyncClient
 from src.recovery_manager import RecoveryManager
+from src.logging_config import setup_logging, stop_logging
+from src import fast_json
 
 
-# Setup logging
-LOG_DIR = Path(os.path.dirname(__file__)) / 'logs'
-LOG_DIR.mkdir(exist_ok=True)
-LOG_FILE = LOG_DIR / 'retailstack.log'
+# Logging is configured in main(): rotating file + console behind a queue listener
+LOG_FILE = Path(os.path.dirname(__file__)) / 'logs' / 'retailstack.log'
+LOG_MAX_BYTES = 10_000_000
+LOG_BACKUP_COUNT = 5
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler(LOG_FILE), logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
 
+# Receipts are written to SQLite in batches: one commit per batch instead of per receipt
+WRITE_QUEUE_SIZE = 1024
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_WAIT = 0.05  # seconds
+WRITE_RETRY_ATTEMPTS = 5
+# Committed receipts are handed to a separate sync thread; a full queue just leaves
+# rows pending in SQLite for the recovery manager to replay
+SYNC_QUEUE_SIZE = 256
+SYNC_WAIT = 0.5  # seconds
+# Receipts committed close together go to the backup API in one request
+SYNC_BATCH_SIZE = 32
+SYNC_BATCH_WAIT = 0.1  # seconds
+# While idle, the sync thread retries pending_sync rows that are due: failed syncs
+# (backed off by mark_failed) and receipts dropped from a full sync queue. Rows
+# younger than the grace period are left to the live path above.
+PENDING_RETRY_INTERVAL = 30.0  # seconds between checks
+PENDING_RETRY_GRACE = 60.0  # seconds
+PENDING_RETRY_LIMIT = 32  # rows per check
+# /status reads SQLite at most once per TTL, however many browser tabs poll it
+STATUS_CACHE_TTL = 1.0  # seconds
+STATUS_UNSYNCED_LIMIT = 10  # rows shown in the UI's unsynced table
+
 
 def _load_config():
     config_path = Path(__file__).parent / 'config.json'
@@ -47,14 +68,23 @@ class POSAgent:
     def __init__(self):
         self.running = False
         config = _load_config()
-        self.buffer = TransactionBuffer(config.get('db_path', 'retailstack_pos.db'))
+        # The buffer keeps one writer connection (used by the writer thread, plus the
+        # occasional sync/recovery update) and a pool of read-only connections for /status
+        self.buffer = TransactionBuffer(
+            config.get('db_path', 'retailstack_pos.db'),
+            synchronous=config.get('db_synchronous', 'NORMAL'),
+            pragmas=config.get('db_pragmas'),
+        )
         # Backup API: still save locally, also POST to backend
         server_url = config.get('server_url') or config.get('backup_api_url')
+        # Imported here so tools that only import main for its helpers skip urllib3
+        from src.sync_client import SyncClient, StubSyncClient
         if server_url:
             self.sync_client = SyncClient(
                 server_url,
                 api_key=config.get('api_key'),
                 transactions_path=config.get('backup_transactions_path', '/api/pos/transactions'),
+                batch_path=config.get('backup_batch_path', '/api/transactions/batch'),
             )
         else:
             self.sync_client = StubSyncClient()
@@ -64,46 +94,228 @@ class POSAgent:
         self.interceptor = None
         self.printer_id = config.get('printer_id', 'store-1')
         self.port = config.get('interceptor_port', 9100)
+        # Parsed receipts waiting to be committed by the writer thread
+        self.write_q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._writer_stop = threading.Event()
+        self._writer_thread = None
+        # Batches of committed (tx_id, transaction, items_json) waiting for the backup API
+        self.sync_q = queue.Queue(maxsize=SYNC_QUEUE_SIZE)
+        self._sync_stop = threading.Event()
+        self._sync_thread = None
+        self._batch_sync = True  # cleared if the backup API has no batch endpoint
+        self._status_lock = threading.Lock()
+        self._status_cache = (0.0, None)  # (monotonic time, (stats, unsynced))
+        self._status_body = None  # (snapshot, (port, running), etag, encoded body)
     
     def _on_gap_detected(self, gap_info):
-        logger.warning(f"GAP: {gap_info}")
+        logger.warning("GAP: %s", gap_info)
     
     def _on_printer_data(self, data: bytes):
-        logger.info(f"Received {len(data)} bytes")
+        logger.info("Received %d bytes", len(data))
         transaction = self.parser.parse(data)
         self.gap_detector.check_sequence(transaction.receipt_id, self.printer_id)
         
-        items = [{'name': i.name, 'quantity': i.quantity, 'unit_price': i.unit_price, 'total': i.total}
-                 for i in transaction.items]
+        # Hand off to the writer thread; it saves locally first, then syncs
+        self.write_q.put(transaction)
+    
+    def _writer_loop(self):
+        """Drain the write queue and commit receipts in batches."""
+        while not self._writer_stop.is_set() or not self.write_q.empty():
+            try:
+                batch = [self.write_q.get(timeout=WRITE_BATCH_WAIT)]
+            except queue.Empty:
+                continue
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.write_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush_batch(batch)
+            except Exception as e:
+                logger.error("Failed to write batch of %d transaction(s): %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self.write_q.task_done()
+    
+    def _flush_batch(self, batch):
+        # Serialize each receipt's items once; the row, pending_sync payload and
+        # backup API request all reuse the same JSON
+        items_jsons = [fast_json.dumps(transaction.items).decode('utf-8') for transaction in batch]
+        records = [
+            (transaction.receipt_id, transaction.items, transaction.total,
+             transaction.subtotal, transaction.tax, self.printer_id,
+             'sale', False, items_json)
+            for transaction, items_json in zip(batch, items_jsons)
+        ]
+        # Save to local DB first: one commit for the whole batch
+        try:
+            tx_ids = self.buffer.add_transactions(records)
+        except sqlite3.Error as e:
+            logger.warning("Batch write failed (%s); retrying %d transaction(s) one by one", e, len(records))
+            self.buffer.rollback()
+            tx_ids = [self._write_with_retry(record) for record in records]
+        
+        saved = []
+        for transaction, tx_id, items_json in zip(batch, tx_ids, items_jsons):
+            if tx_id is None:
+                continue
+            logger.info("Transaction saved locally: %s - N%.2f", transaction.receipt_id, transaction.total)
+            saved.append((tx_id, transaction, items_json))
         
-        # Save to local DB first
-        tx_id = self.buffer.add_transaction(
-            transaction.receipt_id, items, transaction.total,
-            transaction.subtotal, transaction.tax, self.printer_id
-        )
-        logger.info(f"Transaction saved locally: {transaction.receipt_id} - N{transaction.total:.2f}")
+        # Durable now; the network push happens on the sync thread
+        if saved:
+            try:
+                self.sync_q.put_nowait(saved)
+            except queue.Full:
+                logger.warning("Sync queue full; %d transaction(s) left pending for recovery", len(saved))
+    
+    def _sync_loop(self):
+        """Push committed receipts to the backup API and mark them synced in one commit."""
+        next_retry_check = time.monotonic() + PENDING_RETRY_INTERVAL
+        while not self._sync_stop.is_set():
+            try:
+                pending = list(self.sync_q.get(timeout=SYNC_WAIT))
+            except queue.Empty:
+                if time.monotonic() >= next_retry_check:
+                    self._retry_pending_sync()
+                    next_retry_check = time.monotonic() + PENDING_RETRY_INTERVAL
+                continue
+            gets = 1
+            # Give receipts committed right behind this one a moment to join the request
+            deadline = time.monotonic() + SYNC_BATCH_WAIT
+            while len(pending) < SYNC_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.extend(self.sync_q.get(timeout=remaining))
+                    gets += 1
+                except queue.Empty:
+                    break
+            try:
+                synced = []
+                for start in range(0, len(pending), SYNC_BATCH_SIZE):
+                    synced.extend(self._sync_chunk(pending[start:start + SYNC_BATCH_SIZE]))
+                if synced:
+                    self.buffer.mark_synced_many(synced)
+            except Exception as e:
+                logger.error("Failed to record sync of %d transaction(s): %s", len(pending), e)
+            finally:
+                for _ in range(gets):
+                    self.sync_q.task_done()
+    
+    def _retry_pending_sync(self):
+        """Resend pending_sync rows that are due; failures are backed off by mark_failed_many,
+        and rows the backup API rejected for good are dead-lettered."""
+        from src.sync_client import is_rejected  # already loaded by __init__
+        try:
+            due_before = (datetime.now() - timedelta(seconds=PENDING_RETRY_GRACE)).isoformat()
+            rows = self.buffer.get_pending_sync_queue(PENDING_RETRY_LIMIT, due_before=due_before)
+            if not rows:
+                return
+            logger.info("Retrying %d pending transaction(s)", len(rows))
+            synced, failed, rejected = [], [], []
+            for row in rows:
+                # The stored payload is the exact JSON to send; post it without decoding
+                result = self.sync_client.sync_transaction_raw(row['payload'].encode('utf-8'), row['receipt_id'])
+                if result.get('success'):
+                    synced.append((row['transaction_id'], result.get('status_code', 200)))
+                elif is_rejected(result):
+                    # Resending the same payload will not help (e.g. 400/409/422)
+                    rejected.append((row['transaction_id'], result.get('error', 'unknown')))
+                else:
+                    failed.append((row['transaction_id'], result.get('error', 'unknown')))
+            if synced:
+                self.buffer.mark_synced_many(synced)
+            self.buffer.mark_failed_many(failed)
+            if rejected:
+                logger.warning("Backup API rejected %d pending transaction(s); no further retries", len(rejected))
+                self.buffer.mark_rejected_many(rejected)
+        except Exception as e:
+            logger.error("Pending sync retry failed: %s", e)
+    
+    def _sync_chunk(self, chunk):
+        """Sync (tx_id, transaction, items_json) entries; returns [(tx_id, status_code)] for successes."""
+        if len(chunk) > 1 and self._batch_sync:
+            try:
+                result = self.sync_client.sync_batch(
+                    [self._sync_payload(transaction) for _, transaction, _ in chunk],
+                    items_jsons=[items_json for _, _, items_json in chunk],
+                )
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            if result.get('success'):
+                failed = result.get('failed', 0)
+                if not failed:
+                    return [(tx_id, 200) for tx_id, _, _ in chunk]
+                results = result.get('results')
+                if results is not None:
+                    # Receipts the server accepted are synced; resending them would store duplicates
+                    confirmed = [(tx_id, 200) for tx_id, transaction, _ in chunk if results.get(transaction.receipt_id)]
+                    chunk = [entry for entry in chunk if not results.get(entry[1].receipt_id)]
+                else:
+                    # The response does not say which ones failed; send the whole chunk singly
+                    confirmed = []
+                logger.warning("Backup API batch: %d of %d failed; retrying %d one at a time",
+                               failed, len(chunk) + len(confirmed), len(chunk))
+                return confirmed + self._sync_singly(chunk)
+            if result.get('status_code') in (404, 405):
+                logger.info("Backup API has no batch endpoint; syncing transactions one at a time")
+                self._batch_sync = False
         
+        return self._sync_singly(chunk)
+    
+    def _sync_singly(self, chunk):
+        """Sync entries one request each; returns [(tx_id, status_code)] for successes."""
+        synced = []
+        for tx_id, transaction, items_json in chunk:
+            status_code = self._sync_transaction(transaction, items_json)
+            if status_code is not None:
+                synced.append((tx_id, status_code))
+        return synced
+    
+    def _write_with_retry(self, record):
+        """Write a single record, backing off while the database is busy."""
+        delay = 0.05
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return self.buffer.add_transaction(*record)
+            except sqlite3.OperationalError as e:
+                if attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    logger.error("Could not save transaction %s: %s", record[0], e)
+                    return None
+                # Don't let a half-done attempt commit along with the retry
+                self.buffer.rollback()
+                time.sleep(delay)
+                delay *= 2
+    
+    def _sync_payload(self, transaction):
+        """Backup API payload for a transaction, minus 'items' (sent pre-encoded)."""
+        return {
+            'receipt_id': transaction.receipt_id,
+            'printer_id': self.printer_id,
+            'subtotal': transaction.subtotal,
+            'tax': transaction.tax,
+            'total': transaction.total,
+            'timestamp': transaction.timestamp_iso,
+            'replay': False,
+        }
+    
+    def _sync_transaction(self, transaction, items_json=None):
         # Backup: send to remote API. If this fails, nothing breaks; recovery will retry on restart.
+        # Returns the response status code on success, None otherwise.
         try:
-            ts = transaction.timestamp
-            timestamp_str = ts.isoformat() if hasattr(ts, 'isoformat') else str(ts)
-            payload = {
-                'receipt_id': transaction.receipt_id,
-                'printer_id': self.printer_id,
-                'items': items,
-                'subtotal': transaction.subtotal,
-                'tax': transaction.tax,
-                'total': transaction.total,
-                'timestamp': timestamp_str,
-                'replay': False,
-            }
-            result = self.sync_client.sync_transaction(payload)
+            payload = self._sync_payload(transaction)
+            if items_json is None:
+                payload['items'] = transaction.items
+            result = self.sync_client.sync_transaction(payload, items_json=items_json)
             if result.get('success'):
-                self.buffer.mark_synced(tx_id, result.get('status_code', 200))
-            else:
-                logger.warning(f"Backup API sync failed for {transaction.receipt_id}: {result.get('error', 'unknown')}")
+                return result.get('status_code', 200)
+            logger.warning("Backup API sync failed for %s: %s", transaction.receipt_id, result.get('error', 'unknown'))
         except Exception as e:
-            logger.warning(f"Backup API call failed (transaction still saved locally): {e}")
+            logger.warning("Backup API call failed (transaction still saved locally): %s", e)
+        return None
     
     def start(self, port=None):
         if port:
@@ -112,6 +324,19 @@ class POSAgent:
         self.recovery.on_startup()
         self.gap_detector.load_last_id(self.printer_id)
         
+        if self._writer_thread is None or not self._writer_thread.is_alive():
+            self._writer_stop.clear()
+            self._writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer_thread.start()
+        if self._sync_thread is None or not self._sync_thread.is_alive():
+            self._sync_stop.clear()
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._sync_thread.start()
+        
+        self._start_interceptor()
+    
+    def _start_interceptor(self):
+        from src.printer_interceptor import PrinterInterceptor  # socket/serial code, needed only once listening
         self.interceptor = PrinterInterceptor(self._on_printer_data)
         self.interceptor.start_network('0.0.0.0', self.port)
         logger.info(f"Listening on port {self.port}")
@@ -119,23 +344,74 @@ class POSAgent:
         self.running = True
     
     def restart(self, new_port):
+        """Move the interceptor to a new port.
+        
+        Only the listener restarts: the writer and sync threads keep running and
+        already own every unsynced receipt, so recovery is not replayed again.
+        """
         logger.info(f"Restarting on port {new_port}...")
         if self.interceptor:
             self.interceptor.stop()
         self.running = False
         self.port = new_port
-        self.start()
+        self._start_interceptor()
     
-    def get_status(self):
-        stats = self.buffer.get_stats()
-        unsynced = self.buffer.get_unsynced()
+    def stop(self):
+        """Stop listening and flush any queued receipts to the database.
+        
+        Receipts still waiting for the backup API stay pending in SQLite and
+        are replayed by the recovery manager on the next start.
+        """
+        if self.interceptor:
+            self.interceptor.stop()
+        self.running = False
+        self._writer_stop.set()
+        if self._writer_thread:
+            self._writer_thread.join()
+        self._sync_stop.set()
+        if self._sync_thread:
+            self._sync_thread.join()
+        # Every queued receipt is committed by now, so the pending count is complete
+        try:
+            self.recovery.on_shutdown()
+        except Exception as e:
+            logger.error("Could not save shutdown state: %s", e)
+    
+    def _status_snapshot(self):
+        """Return (stats, unsynced), re-reading SQLite at most once per TTL; hold _status_lock"""
+        cached_at, snapshot = self._status_cache
+        now = time.monotonic()
+        if snapshot is None or now - cached_at >= STATUS_CACHE_TTL:
+            snapshot = (self.buffer.get_stats(), self.buffer.get_unsynced_summary(STATUS_UNSYNCED_LIMIT))
+            self._status_cache = (now, snapshot)
+        return snapshot
+    
+    def _status_dict(self, snapshot):
+        stats, unsynced = snapshot
         return {
             'stats': stats, 
-            'unsynced': unsynced[:10],
+            'unsynced': unsynced,
             'port': self.port,
             'running': self.running
         }
     
+    def get_status(self):
+        with self._status_lock:
+            snapshot = self._status_snapshot()
+        return self._status_dict(snapshot)
+    
+    def get_status_body(self):
+        """Return (etag, JSON bytes) for /status, re-encoded only when the status changes."""
+        with self._status_lock:
+            snapshot = self._status_snapshot()
+            live = (self.port, self.running)
+            cached = self._status_body
+            if cached is None or cached[0] is not snapshot or cached[1] != live:
+                body = fast_json.dumps(self._status_dict(snapshot))
+                etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+                cached = self._status_body = (snapshot, live, etag, body)
+        return cached[2], cached[3]
+    
     def simulate_test_data(self):
         test_data = b"""
         STORE NAME
@@ -149,12 +425,12 @@ class POSAgent:
         Receipt #TEST001
         """
         self._on_printer_data(test_data)
+        self.write_q.join()
+        # Make the new transaction visible to the UI's next poll
+        self._status_cache = (0.0, None)
         return "Test data sent!"
 
 
-# Global agent
-agent = POSAgent()
-
 HTML = """
 <!DOCTYPE html>
 <html>
@@ -283,55 +559,110 @@ HTML = """
 </html>
 """
 
-class Handler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(HTML.encode())
-        elif self.path == '/assets/logo.png':
-            logo_path = Path(__file__).parent / 'assets' / 'logo.png'
-            if logo_path.exists():
-                self.send_response(200)
-                self.send_header('Content-type', 'image/png')
-                self.end_headers()
-                self.wfile.write(logo_path.read_bytes())
-            else:
-                self.send_error(404)
-        elif self.path == '/status':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
+# Encoded once; every request for / writes the same bytes
+HTML_BYTES = HTML.encode('utf-8')
+HTML_LEN = str(len(HTML_BYTES))
+# Shared read-only view: each response writes straight from this buffer
+HTML_MV = memoryview(HTML_BYTES)
+# Compressed once at import for clients that accept gzip
+HTML_GZ = memoryview(gzip.compress(HTML_BYTES, 9))
+HTML_GZ_LEN = str(len(HTML_GZ))
+
+# Logo is read from disk once; None if the asset is missing
+LOGO_PATH = Path(__file__).parent / 'assets' / 'logo.png'
+LOGO_BYTES = LOGO_PATH.read_bytes() if LOGO_PATH.exists() else None
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive: the UI polls /status every few seconds over one connection.
+    # Every response must therefore carry a Content-Length.
+    protocol_version = 'HTTP/1.1'
+    
+    def __init__(self, *args, agent=None, **kwargs):
+        # Set before super().__init__, which handles the request immediately
+        self.agent = agent
+        super().__init__(*args, **kwargs)
+    
+    def _send(self, body: bytes, content_type: str, status: int = 200, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _h_index(self, query: str):
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', HTML_GZ_LEN)
+        else:
+            self.send_header('Content-Length', HTML_LEN)
+        self.end_headers()
+        self.wfile.write(HTML_GZ if use_gzip else HTML_MV)
+    
+    def _h_logo(self, query: str):
+        if LOGO_BYTES is not None:
+            self._send(LOGO_BYTES, 'image/png')
+        else:
+            self.send_error(404)
+    
+    def _h_status(self, query: str):
+        etag, body = self.agent.get_status_body()
+        # no-cache: the browser revalidates every poll, and an unchanged status costs a bare 304
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
             self.end_headers()
-            self.wfile.write(json.dumps(agent.get_status()).encode())
-        elif self.path == '/test':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain')
+        else:
+            self._send(body, 'application/json', headers=headers)
+    
+    def _h_test(self, query: str):
+        self._send(self.agent.simulate_test_data().encode(), 'text/plain')
+    
+    def _h_restart(self, query: str):
+        try:
+            port = int(parse_qs(query)['port'][0])
+            self.agent.restart(port)
+            self._send(f"Restarted on port {port}".encode(), 'text/plain')
+        except:
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
             self.end_headers()
-            self.wfile.write(agent.simulate_test_data().encode())
-        elif self.path.startswith('/restart?port='):
-            try:
-                port = int(self.path.split('=')[1])
-                agent.restart(port)
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(f"Restarted on port {port}".encode())
-            except:
-                self.send_response(400)
-                self.end_headers()
+    
+    # Exact path -> handler; the query string is split off once in do_GET
+    ROUTES = {
+        '/': _h_index,
+        '/assets/logo.png': _h_logo,
+        '/status': _h_status,
+        '/test': _h_test,
+        '/restart': _h_restart,
+    }
+    
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        handler = self.ROUTES.get(parts.path)
+        if handler is None:
+            self.send_error(404)
         else:
-            super().do_GET()
+            handler(self, parts.query)
     
     def log_message(self, format, *args):
         pass
 
 
 def main():
+    setup_logging(LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT)
+    agent = POSAgent()
     agent.start()
     
     PORT = 8080
-    server = HTTPServer(('', PORT), Handler)
+    server = ThreadingHTTPServer(('', PORT), functools.partial(Handler, agent=agent))
     
     print("=" * 50)
     print("  RetailStack POS Agent")
@@ -347,6 +678,9 @@ def main():
     except KeyboardInterrupt:
         print("\nStopping...")
         server.shutdown()
+        agent.stop()
+        agent.buffer.close()
+        stop_logging()
 
 
 if __name__ == '__main__':
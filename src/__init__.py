@@ -3,22 +3,36 @@
 
 __version__ = '0.1.0'
 
-from .escpos_parser import ESCPOSParser, Transaction, LineItem
-from .transaction_buffer import TransactionBuffer
-from .gap_detector import GapDetector
-from .printer_interceptor import PrinterInterceptor, VirtualPrinterSetup
-from .sync_client import SyncClient, StubSyncClient
-from .recovery_manager import RecoveryManager
-
-__all__ = [
-    'ESCPOSParser',
-    'Transaction',
-    'LineItem', 
-    'TransactionBuffer',
-    'GapDetector',
-    'PrinterInterceptor',
-    'VirtualPrinterSetup',
-    'SyncClient',
-    'StubSyncClient',
-    'RecoveryManager',
-]
+import importlib
+
+# Public names and the submodule that defines each one. Submodules are imported on
+# first attribute access (PEP 562), so `import src.escpos_parser` does not also pull
+# in urllib3, sqlite3 and the serial/socket code.
+_EXPORTS = {
+    'ESCPOSParser': 'escpos_parser',
+    'Transaction': 'escpos_parser',
+    'LineItem': 'escpos_parser',
+    'BatchTransactions': 'escpos_parser',
+    'TransactionBuffer': 'transaction_buffer',
+    'GapDetector': 'gap_detector',
+    'PrinterInterceptor': 'printer_interceptor',
+    'VirtualPrinterSetup': 'printer_interceptor',
+    'SyncClient': 'sync_client',
+    'StubSyncClient': 'sync_client',
+    'RecoveryManager': 'recovery_manager',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,18 +1,83 @@
 # ESC/POS Parser for RetailStack POS Agent
 # Parses receipt printer byte streams
 
+import os
 import re
+import math
+import mmap
 import logging
-from typing import Dict, List, Optional, Any, Set, Tuple
+from array import array
+from typing import Dict, List, Optional, Any, Set, Tuple, Iterable, Iterator
 from dataclasses import dataclass, field
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# A command lead byte (ESC, GS or DLE) plus the byte after it, if any. Matches do not
+# overlap, so a lead byte that is itself a command's second byte is not a new command.
+_COMMAND_RE = re.compile(rb'[\x1b\x1d\x10][\x00-\xff]?')
+
+# Field patterns, compiled once at import and tried in priority order.
+# Receipt-ID patterns run case-sensitively against the lowercased text: without
+# IGNORECASE the engine can skip ahead to each literal prefix instead of trying
+# every position, and that beats one combined alternation (which loses the prefix).
+_RECEIPT_ID_PATTERNS = tuple(re.compile(p) for p in (
+    r'(?:receipt|receipt no|receipt#|rct)[\s:]*(\w+)',
+    r'(?:inv|invoice)[\s:#]*(\w+)',
+    r'#(\d{4,})',  # 4+ digit number
+    r'trx[_\s]*(\w+)',
+    r'(\d{10,})',  # Timestamp-like ID
+))
+# IGNORECASE twins, for the rare text whose lowercased form changes length
+_RECEIPT_ID_PATTERNS_I = tuple(re.compile(p.pattern, re.IGNORECASE) for p in _RECEIPT_ID_PATTERNS)
+# End of a receipt in a captured stream: the paper cut GS V m, plus a feed byte n
+# for modes 'A'/'B'. As in the printer interceptor's framing, a cut missing its m
+# or n byte (a capture that stops mid-command) does not end a receipt; those bytes
+# stay with the unterminated tail.
+_CUT_RE = re.compile(rb'\x1dV(?:[AB][\x00-\xff]|[^AB])')
+
+# Total and subtotal patterns also run case-sensitively against the lowercased text, so
+# each starts with its literal keyword and the engine jumps straight to it ("grand total"
+# is found through its "total"). Only digits are captured, which lowercasing leaves alone.
+_TOTAL_PATTERNS = tuple(re.compile(p) for p in (
+    r'total[\s:]*([\d,]+\.?\d*)',
+    r'amount[\s:]*([\d,]+\.?\d*)',
+    r'due[\s:]*([\d,]+\.?\d*)',
+    r'[\* ]+\s*([\d,]+\.?\d{2})',
+))
+_CURRENCY_NUMBER_RE = re.compile(r'[\d,]+\.?\d{2}')
+_SUBTOTAL_PATTERNS = tuple(re.compile(p) for p in (
+    r'subtotal[\s:]*([\d,]+\.?\d*)',
+    r'sub[\s-]*total[\s:]*([\d,]+\.?\d*)',
+))
+
+# Matched against one line at a time: a candidate item line is either
+# "name 2 x 500" (qty branch, tried first) or "name 1,500" (price at end of line).
+# [^\S\n] is whitespace that does not cross into the next line.
+_ITEM_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:'
+    r'(?P<qname>.*?)(?P<qty>\d+)[^\S\n]*[xX×][^\S\n]*(?P<qprice>[\d,]+\.?\d*).*'
+    r'|(?P<name>.+?)[^\S\n]+(?P<price>[\d,]+\.?\d*)[^\S\n]*'
+    r')$',
+    re.MULTILINE,
+)
+# Every item line has a digit (qty or price); lines without one skip the item regex
+_DIGIT_RE = re.compile(r'\d')
+# Header/footer lines containing any of these are not items
+_SKIP_WORDS = ('total', 'subtotal', 'tax', 'change', 'cash', 'card',
+               'thank', 'welcome', 'please', 'receipt', 'invoice',
+               '========================', '------------------')
+# Matched against the lowercased line; a case-sensitive alternation is much faster than IGNORECASE
+_SKIP_RE = re.compile('|'.join(re.escape(word) for word in _SKIP_WORDS))
+
 
 @dataclass
 class LineItem:
     """Represents a single line item on a receipt"""
+    # No per-instance __dict__: receipts carry many items (fields have no defaults,
+    # so plain __slots__ works on every supported Python, unlike slots=True)
+    __slots__ = ('name', 'quantity', 'unit_price', 'total')
+    
     name: str
     quantity: int
     unit_price: float
@@ -28,10 +93,56 @@ class Transaction:
     tax: float = 0.0
     total: float = 0.0
     timestamp: datetime = field(default_factory=datetime.now)
+    timestamp_iso: str = ""  # timestamp.isoformat(), filled in once by __post_init__
     raw_data: str = ""
     # Edge-case flags
     is_incomplete: bool = False  # True if session lacked total/receipt_id/items
     transaction_type: str = "sale"  # 'sale' | 'void' | 'refund'
+    
+    def __post_init__(self):
+        if not self.timestamp_iso:
+            self.timestamp_iso = self.timestamp.isoformat()
+
+
+@dataclass
+class BatchTransactions:
+    """Many parsed receipts stored column-wise for bulk aggregation.
+    
+    Numbers live in typed arrays (8 bytes per value, no float/int objects per
+    field). Transaction i's items are item_offsets[i]:item_offsets[i + 1] in the
+    item columns.
+    """
+    receipt_ids: List[str] = field(default_factory=list)
+    transaction_types: List[str] = field(default_factory=list)
+    subtotals: array = field(default_factory=lambda: array('d'))
+    taxes: array = field(default_factory=lambda: array('d'))
+    totals: array = field(default_factory=lambda: array('d'))
+    item_offsets: array = field(default_factory=lambda: array('q', [0]))
+    item_names: List[str] = field(default_factory=list)
+    quantities: array = field(default_factory=lambda: array('q'))
+    unit_prices: array = field(default_factory=lambda: array('d'))
+    item_totals: array = field(default_factory=lambda: array('d'))
+    
+    def __len__(self) -> int:
+        return len(self.receipt_ids)
+    
+    def append(self, transaction: Transaction):
+        """Copy a parsed transaction's fields into the columns"""
+        self.receipt_ids.append(transaction.receipt_id)
+        self.transaction_types.append(transaction.transaction_type)
+        self.subtotals.append(transaction.subtotal)
+        self.taxes.append(transaction.tax)
+        self.totals.append(transaction.total)
+        items = transaction.items
+        self.item_names.extend([item.name for item in items])
+        self.quantities.extend([item.quantity for item in items])
+        self.unit_prices.extend([item.unit_price for item in items])
+        self.item_totals.extend([item.total for item in items])
+        self.item_offsets.append(len(self.item_names))
+    
+    def totals_sum(self) -> float:
+        """Sum of all receipt totals"""
+        return math.fsum(self.totals)
 
 
 class ESCPOSParser:
@@ -53,6 +164,14 @@ class ESCPOSParser:
     # Known manufacturers
     SUPPORTED_PRINTERS = ['epson', 'star', 'bixolon']
     
+    # (byte signature, manufacturer) for detect_printer, first hit wins
+    PRINTER_SIGNATURES = (
+        (b'ST', 'star'),      # also covers STAR
+        (b'BIX', 'bixolon'),  # also covers BIXOLON
+        (b'ESC', 'epson'),
+        (b'EPSON', 'epson'),
+    )
+    
     # Known ESC/POS command prefixes (ESC/GS + next byte or more) - we don't log these as unknown
     KNOWN_ESC_SEQUENCES = {
         (0x1B, 0x40),   # ESC @ Initialize
@@ -71,6 +190,8 @@ class ESCPOSParser:
         (0x1D, 0x6B),   # GS k Barcode
         (0x10, 0x04),   # DLE EOT
     }
+    # Same pairs packed as (lead << 8) | next: one int hash per lookup, no tuple per command
+    _KNOWN_COMMAND_CODES = frozenset((lead << 8) | nxt for lead, nxt in KNOWN_ESC_SEQUENCES)
     
     def __init__(self, log_unknown_commands: bool = True):
         self.manufacturer = 'epson'  # Default
@@ -79,42 +200,42 @@ class ESCPOSParser:
     
     def _collect_unknown_commands(self, raw_data: bytes) -> None:
         """Scan raw byte stream for ESC/GS/DLE commands; record unknown ones as hex."""
-        i = 0
-        data = bytearray(raw_data)
-        while i < len(data):
-            if data[i] == 0x1B or data[i] == 0x1D or data[i] == 0x10:
-                lead = data[i]
-                # Two-byte command
-                if i + 1 < len(data):
-                    key = (lead, data[i + 1])
-                    if key not in self.KNOWN_ESC_SEQUENCES:
-                        cmd_hex = ' '.join(f'{b:02X}' for b in data[i:i+2])
-                        entry = f"raw[{i}]: {cmd_hex}"
-                        if entry not in self.unknown_commands:
-                            self.unknown_commands.append(entry)
-                        if self.log_unknown_commands:
-                            logger.debug("Unknown ESC/POS command: %s", cmd_hex)
-                    i += 2
-                    continue
-                else:
-                    self.unknown_commands.append(f"raw[{i}]: {lead:02X} (incomplete)")
-                    if self.log_unknown_commands:
-                        logger.debug("Incomplete command at end: %02X", lead)
-            i += 1
+        # The regex engine skips plain text; only command bytes reach Python
+        seen = set(self.unknown_commands)  # O(1) de-dup instead of scanning the list
+        # Decided once per receipt rather than by a logger.debug() call per command
+        log_debug = self.log_unknown_commands and logger.isEnabledFor(logging.DEBUG)
+        for match in _COMMAND_RE.finditer(raw_data):
+            i = match.start()
+            cmd = match.group()
+            lead = cmd[0]
+            # Two-byte command
+            if len(cmd) == 2:
+                if ((lead << 8) | cmd[1]) not in self._KNOWN_COMMAND_CODES:
+                    cmd_hex = ' '.join(f'{b:02X}' for b in cmd)
+                    entry = f"raw[{i}]: {cmd_hex}"
+                    if entry not in seen:
+                        seen.add(entry)
+                        self.unknown_commands.append(entry)
+                    if log_debug:
+                        logger.debug("Unknown ESC/POS command: %s", cmd_hex)
+            else:
+                self.unknown_commands.append(f"raw[{i}]: {lead:02X} (incomplete)")
+                if log_debug:
+                    logger.debug("Incomplete command at end: %02X", lead)
     
     def parse(self, raw_data: bytes) -> Transaction:
         """Parse ESC/POS byte stream into Transaction"""
         self.unknown_commands = []
         self._collect_unknown_commands(raw_data)
         
-        # Decode to string, handling common encodings
-        try:
-            text = raw_data.decode('cp1252')  # Windows default
-        except Exception:
-            try:
-                text = raw_data.decode('latin-1')
-            except Exception:
-                text = raw_data.decode('utf-8', errors='ignore')
+        # Decode to string: cp1252 (Windows default) in one pass; the few bytes it leaves
+        # undefined (0x81, 0x8D, 0x8F, 0x90, 0x9D) become U+FFFD, one character per byte.
+        # Most receipts (text plus ESC/GS commands) are pure ASCII, where cp1252 is identity
+        # and the ASCII codec is several times faster.
+        if raw_data.isascii():
+            text = raw_data.decode('ascii')
+        else:
+            text = raw_data.decode('cp1252', errors='replace')
         
         receipt_id = self._extract_receipt_id(text)
         transaction = Transaction(receipt_id=receipt_id, raw_data=text[:200])
@@ -142,53 +263,77 @@ class ESCPOSParser:
             )
         return transaction
     
+    def parse_many(self, buffers: Iterable[bytes]) -> BatchTransactions:
+        """Parse several byte streams into one column-wise BatchTransactions"""
+        batch = BatchTransactions()
+        for raw_data in buffers:
+            batch.append(self.parse(raw_data))
+        return batch
+    
+    def parse_file(self, path: str) -> Iterator[Transaction]:
+        """Parse a captured printer log, one Transaction per cut-terminated receipt.
+        
+        The file is memory-mapped rather than read into one bytes object, so only
+        the receipt being parsed is copied out of the page cache. Bytes after the
+        last complete cut are parsed as a final receipt unless they are blank.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return  # mmap cannot map an empty file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                start = 0
+                for match in _CUT_RE.finditer(mm):
+                    yield self.parse(mm[start:match.end()])
+                    start = match.end()
+                if mm[start:].strip():
+                    yield self.parse(mm[start:])
+    
     def _extract_receipt_id(self, text: str) -> str:
         """Extract receipt/transaction ID"""
-        patterns = [
-            r'(?:receipt|receipt No|receipt#|RCT)[\s:]*(\w+)',
-            r'(?:inv|invoice)[\s:#]*(\w+)',
-            r'#(\d{4,})',  # 4+ digit number
-            r'TRX[_\s]*(\w+)',
-            r'(\d{10,})',  # Timestamp-like ID
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return match.group(1)
+        lower = text.lower()
+        # Lowercasing keeps offsets for cp1252 text; slice the ID from the original case
+        if len(lower) == len(text):
+            for pattern in _RECEIPT_ID_PATTERNS:
+                match = pattern.search(lower)
+                if match:
+                    return text[match.start(1):match.end(1)]
+        else:
+            for pattern in _RECEIPT_ID_PATTERNS_I:
+                match = pattern.search(text)
+                if match:
+                    return match.group(1)
         
         return f"RX-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     
     def _extract_items(self, text: str) -> List[LineItem]:
         """Extract line items from receipt"""
         items = []
-        lines = text.split('\n')
+        # Bound once; looked up on every line below
+        has_digit = _DIGIT_RE.search
+        skip = _SKIP_RE.search
+        item_match = _ITEM_LINE_RE.match
+        parse_price = self._parse_price
         
-        # Patterns for quantity x price format
-        item_patterns = [
-            r'(\d+)\s*[xX×]\s*([\d,]+\.?\d*)',  # "2 x 500" or "2×500"
-            r'(.+?)\s+([\d,]+\.?\d*)\s*$',  # Item name followed by price
-        ]
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
+        # Line by line, cheapest rejection first: most header/footer lines never reach
+        # the item regex
+        for line in text.split('\n'):
+            if not has_digit(line):
                 continue
-            
             # Skip header/footer lines
-            skip_words = ['total', 'subtotal', 'tax', 'change', 'cash', 'card', 
-                         'thank', 'welcome', 'please', 'receipt', 'invoice',
-                         '========================', '------------------']
-            if any(word in line.lower() for word in skip_words):
+            if skip(line.lower()):
+                continue
+            match = item_match(line)
+            if match is None:
                 continue
             
-            # Try quantity x price pattern
-            match = re.search(r'(\d+)\s*[xX×]\s*([\d,]+\.?\d*)', line)
-            if match:
-                qty = int(match.group(1))
-                price = self._parse_price(match.group(2))
-                # Try to get item name
-                name_part = line[:match.start()].strip()
+            # Quantity x price pattern
+            if match.group('qty') is not None:
+                qty = int(match.group('qty'))
+                price = parse_price(match.group('qprice'))
+                # Item name is whatever precedes the quantity
+                name_part = match.group('qname').strip()
                 if name_part:
                     items.append(LineItem(
                         name=name_part,
@@ -196,14 +341,13 @@ class ESCPOSParser:
                         unit_price=price,
                         total=qty * price
                     ))
-                continue
             
-            # Try price at end pattern (with or without decimals, e.g. 1,500 or 1000.00)
-            match = re.search(r'(.+?)\s+([\d,]+\.?\d*)\s*$', line)
-            if match:
-                name = match.group(1).strip()
-                price = self._parse_price(match.group(2))
-                if name and price > 0 and not any(c in name.lower() for c in ['total', 'tax', 'sub']):
+            # Price at end pattern (with or without decimals, e.g. 1,500 or 1000.00)
+            else:
+                name = match.group('name').strip()
+                price = parse_price(match.group('price'))
+                # 'total' and 'tax' lines were already dropped by _SKIP_RE; only 'sub' is left to check
+                if name and price > 0 and 'sub' not in name.lower():
                     items.append(LineItem(
                         name=name,
                         quantity=1,
@@ -215,35 +359,26 @@ class ESCPOSParser:
     
     def _extract_total(self, text: str) -> float:
         """Extract total amount"""
-        patterns = [
-            r'(?:grand\s*)?total[\s:]*([\d,]+\.?\d*)',
-            r'amount[\s:]*([\d,]+\.?\d*)',
-            r'due[\s:]*([\d,]+\.?\d*)',
-            r'[\* ]+\s*([\d,]+\.?\d{2})',
-        ]
-        
         # Look for largest number near "total" or at end
-        for pattern in patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
+        lower = text.lower()
+        for pattern in _TOTAL_PATTERNS:
+            matches = pattern.findall(lower)
             if matches:
                 return self._parse_price(matches[-1])  # Last match usually total
         
-        # Fallback: find largest currency-like number
-        numbers = re.findall(r'[\d,]+\.?\d{2}', text)
-        if numbers:
-            return max(self._parse_price(n) for n in numbers)
-        
-        return 0.0
+        # Fallback: largest currency-like number, tracked while scanning (no findall list)
+        best = 0.0
+        for match in _CURRENCY_NUMBER_RE.finditer(text):
+            value = self._parse_price(match.group())
+            if value > best:
+                best = value
+        return best
     
     def _extract_subtotal(self, text: str) -> float:
         """Extract subtotal"""
-        patterns = [
-            r'subtotal[\s:]*([\d,]+\.?\d*)',
-            r'sub[\s-]*total[\s:]*([\d,]+\.?\d*)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        lower = text.lower()
+        for pattern in _SUBTOTAL_PATTERNS:
+            match = pattern.search(lower)
             if match:
                 return self._parse_price(match.group(1))
         
@@ -269,14 +404,10 @@ class ESCPOSParser:
     
     def detect_printer(self, raw_data: bytes) -> str:
         """Detect printer manufacturer"""
-        data_str = str(raw_data)
-        
-        if b'ST' in raw_data or 'STAR' in data_str:
-            return 'star'
-        elif b'BIX' in raw_data or 'BIXOLON' in data_str:
-            return 'bixolon'
-        elif b'ESC' in raw_data or 'EPSON' in data_str:
-            return 'epson'
+        # Plain bytes substring tests, no str(raw_data) copy of the whole stream
+        for signature, manufacturer in self.PRINTER_SIGNATURES:
+            if signature in raw_data:
+                return manufacturer
         
         return 'unknown'
     
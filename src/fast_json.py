@@ -0,0 +1,58 @@
+# Fast JSON helpers for RetailStack POS Agent
+# Uses msgspec or orjson (C-accelerated) when installed, otherwise the stdlib json module
+
+import json
+import dataclasses
+from typing import Any
+
+# msgspec - optional; encodes dataclasses natively, no default= callback
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+except ImportError:
+    MSGSPEC_AVAILABLE = False
+
+# orjson - optional
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _default(obj: Any) -> Any:
+    """Fallback encoder for the stdlib path: dataclasses become dicts"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize obj (dataclasses included) to UTF-8 encoded JSON bytes"""
+    if MSGSPEC_AVAILABLE:
+        return _encoder.encode(obj)
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_with_raw(obj: dict, **raw: str) -> bytes:
+    """Serialize dict obj, splicing in values that are already JSON-encoded strings"""
+    body = dumps(obj)
+    if not raw:
+        return body
+    fields = b','.join(dumps(key) + b':' + value.encode('utf-8') for key, value in raw.items())
+    if body == b'{}':
+        return b'{' + fields + b'}'
+    return b'{' + fields + b',' + body[1:]
+
+
+def loads(data) -> Any:
+    """Deserialize JSON from str or bytes"""
+    if MSGSPEC_AVAILABLE:
+        return _decoder.decode(data)
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -5,6 +5,10 @@ import re
 from typing import List, Dict, Optional, Callable
 from datetime import datetime, timedelta
 
+# Numeric part of a receipt ID: trailing digits preferred, else the first digit run
+_DIGITS = '0123456789'
+_ANY_NUM_RE = re.compile(r'(\d+)')
+
 
 class GapDetector:
     """Detects sequence gaps in receipt IDs"""
@@ -13,6 +17,9 @@ class GapDetector:
         self.buffer = buffer
         self.alert_callback = alert_callback
         self.last_receipt_id = {}
+        # printer_id -> (receipt_id, numeric part) for the ID last seen, so the previous
+        # receipt is not re-parsed; ignored if last_receipt_id was changed from outside
+        self._last_numeric = {}
     
     def check_sequence(self, new_receipt_id: str, printer_id: str = None) -> Optional[Dict]:
         """Check if new receipt ID creates a gap"""
@@ -20,73 +27,65 @@ class GapDetector:
         
         # Try to extract numeric ID
         numeric_id = self._extract_numeric(new_receipt_id)
-        
-        if numeric_id is None:
-            # Can't do numeric gap detection on non-numeric IDs
-            self.last_receipt_id[printer_id] = new_receipt_id
-            return None
-        
         last_id = self.last_receipt_id.get(printer_id)
+        cached = self._last_numeric.get(printer_id)
+        self._last_numeric[printer_id] = (new_receipt_id, numeric_id)
         
-        if last_id is None:
-            # First receipt, no gap to check
+        if numeric_id is None or last_id is None:
+            # Non-numeric ID, or first receipt: no gap to check
             self.last_receipt_id[printer_id] = new_receipt_id
             return None
         
-        last_numeric = self._extract_numeric(last_id)
-        if last_numeric is None:
-            # Last wasn't numeric, can't detect gap
+        if cached is not None and cached[0] == last_id:
+            last_numeric = cached[1]
+        else:
+            last_numeric = self._extract_numeric(last_id)
+        
+        # Sequential, sequence reset (new day?), or last wasn't numeric: just update
+        if last_numeric is None or numeric_id <= last_numeric + 1:
             self.last_receipt_id[printer_id] = new_receipt_id
             return None
         
-        # Check for gap
+        # Gap detected!
         expected = last_numeric + 1
+        gap_info = {
+            'printer_id': printer_id,
+            'expected_receipt_id': str(expected),
+            'missing_receipt_id': str(numeric_id),
+            'last_receipt_id': last_id,
+            'new_receipt_id': new_receipt_id,
+            'gap_size': numeric_id - expected,
+            'detected_at': datetime.now().isoformat()
+        }
         
-        if numeric_id > expected:
-            # Gap detected!
-            gap_info = {
-                'printer_id': printer_id,
-                'expected_receipt_id': str(expected),
-                'missing_receipt_id': str(numeric_id),
-                'last_receipt_id': last_id,
-                'new_receipt_id': new_receipt_id,
-                'gap_size': numeric_id - expected,
-                'detected_at': datetime.now().isoformat()
-            }
-            
-            # Log to database
-            self.buffer.log_gap(
-                printer_id, 
-                str(expected), 
-                str(numeric_id)
-            )
-            
-            # Alert if callback
-            if self.alert_callback:
-                self.alert_callback(gap_info)
-            
-            self.last_receipt_id[printer_id] = new_receipt_id
-            return gap_info
+        # Log to database
+        self.buffer.log_gap(
+            printer_id, 
+            str(expected), 
+            str(numeric_id)
+        )
         
-        elif numeric_id < expected:
-            # Sequence reset (new day?) - just update
-            pass
+        # Alert if callback
+        if self.alert_callback:
+            self.alert_callback(gap_info)
         
         self.last_receipt_id[printer_id] = new_receipt_id
-        return None
+        return gap_info
     
     def _extract_numeric(self, receipt_id: str) -> Optional[int]:
         """Extract numeric portion from receipt ID"""
         if not receipt_id:
             return None
         
-        # Try to find trailing numbers
-        match = re.search(r'(\d+)$', str(receipt_id))
-        if match:
-            return int(match.group(1))
+        receipt_id = str(receipt_id)
+        
+        # Trailing numbers: rstrip does the scan in C, no regex needed for e.g. RCT1050
+        head = receipt_id.rstrip(_DIGITS)
+        if len(head) != len(receipt_id):
+            return int(receipt_id[len(head):])
         
         # Try to find any numbers
-        match = re.search(r'(\d+)', str(receipt_id))
+        match = _ANY_NUM_RE.search(receipt_id)
         if match:
             return int(match.group(1))
         
@@ -97,17 +96,22 @@ class GapDetector:
         gaps = []
         receipt_ids = self.buffer.get_receipt_ids(printer_id)
         
-        for i in range(1, len(receipt_ids)):
-            prev_numeric = self._extract_numeric(receipt_ids[i-1])
-            curr_numeric = self._extract_numeric(receipt_ids[i])
+        # Each ID is parsed once; its number is carried over as the next iteration's previous
+        extract = self._extract_numeric
+        prev_numeric = extract(receipt_ids[0]) if receipt_ids else None
+        
+        for receipt_id in receipt_ids[1:]:
+            curr_numeric = extract(receipt_id)
             
             if prev_numeric and curr_numeric and curr_numeric > prev_numeric + 1:
                 gap_info = {
                     'expected': str(prev_numeric + 1),
-                    'found': receipt_ids[i],
+                    'found': receipt_id,
                     'gap_size': curr_numeric - prev_numeric - 1
                 }
                 gaps.append(gap_info)
+            
+            prev_numeric = curr_numeric
         
         return gaps
     
@@ -116,9 +120,9 @@ class GapDetector:
         printer_id = printer_id or 'default'
         
         # Get most recent receipt
-        receipt_ids = self.buffer.get_receipt_ids(printer_id)
-        if receipt_ids:
-            self.last_receipt_id[printer_id] = receipt_ids[-1]
+        last_id = self.buffer.get_last_receipt_id(printer_id)
+        if last_id:
+            self.last_receipt_id[printer_id] = last_id
     
     def reset(self, printer_id: str = None):
         """Reset detection state"""
@@ -1,8 +1,12 @@
 # Logging configuration - RotatingFileHandler, structured format, error alerting
+# Handlers run on a QueueListener thread so callers never block on disk I/O
 
+import atexit
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 from typing import Optional, Callable
 
@@ -15,6 +19,9 @@ LOG_BACKUP_COUNT = 5
 # Optional: call this when an ERROR is logged (e.g. send to monitoring)
 _error_alert_callback: Optional[Callable[[str, str], None]] = None
 
+# Background listener that owns the real handlers (see setup_logging)
+_queue_listener: Optional[QueueListener] = None
+
 
 def set_error_alert_callback(callback: Callable[[str, str], None]):
     """Set a callback(message, level) for error alerting."""
@@ -22,16 +29,43 @@ def set_error_alert_callback(callback: Callable[[str, str], None]):
     _error_alert_callback = callback
 
 
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter that renders asctime with strftime at most once per second."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._time_cache = (None, None, "")  # (second, datefmt, text)
+        # format() asks this for every record; the base class re-searches the fmt string each time
+        self._uses_time = super().usesTime()
+
+    def usesTime(self) -> bool:
+        return self._uses_time
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        datefmt = datefmt or self.datefmt
+        second = int(record.created)
+        cached_second, cached_datefmt, text = self._time_cache
+        if second != cached_second or datefmt != cached_datefmt:
+            text = time.strftime(datefmt or self.default_time_format, self.converter(record.created))
+            self._time_cache = (second, datefmt, text)
+        if datefmt is None and self.default_msec_format:
+            # Like the base class: no datefmt means ",msecs" follows, and that changes within the second
+            return self.default_msec_format % (text, record.msecs)
+        return text
+
+
 class ErrorAlertHandler(logging.Handler):
     """Handler that invokes the alert callback on ERROR and CRITICAL."""
 
     def emit(self, record: logging.LogRecord):
-        if record.levelno >= logging.ERROR and _error_alert_callback:
-            try:
-                msg = self.format(record)
-                _error_alert_callback(msg, record.levelname)
-            except Exception:
-                self.handleError(record)
+        # No callback installed: return before paying for format()
+        callback = _error_alert_callback
+        if callback is None or record.levelno < logging.ERROR:
+            return
+        try:
+            callback(self.format(record), record.levelname)
+        except Exception:
+            self.handleError(record)
 
 
 def setup_logging(
@@ -43,40 +77,64 @@ def setup_logging(
 ) -> None:
     """
     Configure structured logging with file rotation and optional console.
+    The root logger only enqueues records; a QueueListener thread formats
+    and writes them, so logging from the receipt path never waits on disk.
     """
+    global _queue_listener
     log_path = log_path or LOG_FILE
     log_path = Path(log_path)
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
-    formatter = logging.Formatter(
-        fmt="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
+    formatter = CachedTimeFormatter(
+        fmt="{asctime} | {levelname:<8} | {name} | {message}",
         datefmt="%Y-%m-%d %H:%M:%S",
+        style="{",
     )
 
     root = logging.getLogger()
     root.setLevel(level)
     # Avoid duplicate handlers when called multiple times
+    stop_logging()
     for h in list(root.handlers):
         root.removeHandler(h)
 
+    handlers = []
+
     # Rotating file
     file_handler = RotatingFileHandler(
         log_path,
         maxBytes=max_bytes,
         backupCount=backup_count,
         encoding="utf-8",
+        delay=True,
     )
     file_handler.setFormatter(formatter)
-    root.addHandler(file_handler)
+    handlers.append(file_handler)
 
     # Console
     if console:
         console_handler = logging.StreamHandler(sys.stderr)
         console_handler.setFormatter(formatter)
-        root.addHandler(console_handler)
+        handlers.append(console_handler)
 
     # Error alerting
     alert_handler = ErrorAlertHandler()
     alert_handler.setLevel(logging.ERROR)
     alert_handler.setFormatter(formatter)
-    root.addHandler(alert_handler)
+    handlers.append(alert_handler)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    _queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _queue_listener.start()
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the background listener."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+atexit.register(stop_logging)
@@ -1,13 +1,16 @@
 # Printer Interceptor - Windows printer port monitoring for RetailStack POS Agent
 # Intercepts ESC/POS data from thermal printers
 
+import os
+import select
+import selectors
 import socket
 import threading
 import time
 import logging
 import sys
 from typing import Optional, Callable
-from queue import Queue
+import queue
 import serial
 
 # USB support - optional
@@ -30,6 +33,72 @@ if sys.platform == 'win32':
 
 logger = logging.getLogger(__name__)
 
+# A receipt ends with the ESC/POS paper cut, GS V m (modes 'A'/'B' add a feed byte n)
+CUT_COMMAND = b'\x1d\x56'
+CUT_FEED_MODES = (0x41, 0x42)
+# A partial receipt is flushed once the printer has been silent this long
+FRAME_IDLE_TIMEOUT = 1.0  # seconds
+# Pending network connections; several printers can send to one agent at once
+NETWORK_BACKLOG = 8
+# How long stop() waits for the dispatcher to hand over receipts already received
+DISPATCH_STOP_TIMEOUT = 5.0  # seconds
+_STOP_DISPATCH = object()  # queued by stop() after the last receipt
+
+
+class _FrameBuffer:
+    """Accumulates printer bytes and cuts complete receipts (ending in a cut command) off the front.
+    
+    Remembers where the last search for the cut command stopped, so each read only
+    scans the new bytes instead of the whole receipt received so far. The bytes live
+    in a bytearray: appends grow it in place rather than copying it on every read.
+    """
+    
+    def __init__(self):
+        self.data = bytearray()
+        self._scan_from = 0
+    
+    def __len__(self) -> int:
+        return len(self.data)
+    
+    def feed(self, data: bytes) -> list:
+        """Append data; return the receipts it completed, oldest first"""
+        self.data.extend(data)
+        frames = []
+        while True:
+            idx = self.data.find(CUT_COMMAND, self._scan_from)
+            if idx < 0:
+                # A GS at the very end may be the first half of a cut split across reads
+                self._scan_from = max(0, len(self.data) - len(CUT_COMMAND) + 1)
+                break
+            end = idx + len(CUT_COMMAND) + 1
+            if end <= len(self.data) and self.data[end - 1] in CUT_FEED_MODES:
+                end += 1
+            if end > len(self.data):
+                self._scan_from = idx  # cut parameters not received yet
+                break
+            frames.append(bytes(self.data[:end]))
+            del self.data[:end]  # bytearray drops a prefix without moving the rest
+            self._scan_from = 0
+        return frames
+    
+    def take(self) -> bytes:
+        """Remove and return everything buffered (the start of an unterminated receipt)"""
+        data = bytes(self.data)
+        self.data.clear()
+        self._scan_from = 0
+        return data
+
+
+class _PrinterConnection:
+    """Per-connection state for the network listener"""
+    
+    __slots__ = ('addr', 'buffer', 'last_data')
+    
+    def __init__(self, addr):
+        self.addr = addr
+        self.buffer = _FrameBuffer()
+        self.last_data = time.monotonic()
+
 
 class PrinterInterceptor:
     """Intercepts ESC/POS data from thermal printers"""
@@ -42,6 +111,12 @@ class PrinterInterceptor:
         self.on_reconnect = on_reconnect
         self.running = False
         self.thread = None
+        # Set by stop(); idle waits block on it instead of polling self.running
+        self._stop_event = threading.Event()
+        # Receipts go from the listener to a dispatcher thread that runs on_data_callback,
+        # so parsing a receipt never holds up reading the next one
+        self._frames = queue.SimpleQueue()
+        self._dispatch_thread = None
         self.mode = None  # 'usb', 'serial', 'network', 'virtual'
         self._reconnect_delay = 5
         self._reconnect_max_delay = 60
@@ -63,6 +138,8 @@ class PrinterInterceptor:
         self.printer_config['product_id'] = product_id
         
         self.running = True
+        self._stop_event.clear()
+        self._start_dispatcher()
         self.thread = threading.Thread(target=self._usb_listener, daemon=True)
         self.thread.start()
         logger.info("USB interception started")
@@ -73,6 +150,8 @@ class PrinterInterceptor:
         self.printer_config['serial_port'] = port
         
         self.running = True
+        self._stop_event.clear()
+        self._start_dispatcher()
         self.thread = threading.Thread(
             target=self._serial_listener, 
             args=(port, baudrate),
@@ -88,6 +167,8 @@ class PrinterInterceptor:
         self.printer_config['network_port'] = port
         
         self.running = True
+        self._stop_event.clear()
+        self._start_dispatcher()
         self.thread = threading.Thread(
             target=self._network_listener,
             args=(host, port),
@@ -103,6 +184,8 @@ class PrinterInterceptor:
         
         if WIN32_AVAILABLE:
             self.running = True
+            self._stop_event.clear()
+            self._start_dispatcher()
             self.thread = threading.Thread(
                 target=self._windows_port_listener,
                 args=(port,),
@@ -113,16 +196,50 @@ class PrinterInterceptor:
         else:
             logger.warning("pywin32 not installed. Using stdin fallback.")
             self.running = True
+            self._stop_event.clear()
+            self._start_dispatcher()
             self.thread = threading.Thread(target=self._stdin_listener, daemon=True)
             self.thread.start()
     
     def stop(self):
-        """Stop interception"""
+        """Stop interception; receipts already received are still handed to the callback"""
         self.running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join(timeout=2)
+        if self._dispatch_thread:
+            self._frames.put(_STOP_DISPATCH)
+            self._dispatch_thread.join(timeout=DISPATCH_STOP_TIMEOUT)
+            self._dispatch_thread = None
         logger.info("Interception stopped")
     
+    def _start_dispatcher(self):
+        if self._dispatch_thread is None or not self._dispatch_thread.is_alive():
+            self._dispatch_thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._dispatch_thread.start()
+    
+    def _dispatch_loop(self):
+        """Run on_data_callback for each queued receipt, in arrival order"""
+        while True:
+            frame = self._frames.get()
+            if frame is _STOP_DISPATCH:
+                break
+            try:
+                self.on_data_callback(frame)
+            except Exception as e:
+                logger.error("Error handling printer data: %s", e)
+    
+    def _deliver_frames(self, buffer: _FrameBuffer, data: bytes):
+        """Add data to buffer and queue every receipt it completes for the callback"""
+        for frame in buffer.feed(data):
+            self._frames.put(frame)
+    
+    def _flush_partial(self, buffer: _FrameBuffer):
+        """Queue an unterminated receipt (idle stream or disconnect)"""
+        data = buffer.take()
+        if data.strip():
+            self._frames.put(data)
+    
     def _usb_listener(self):
         """USB listener - simplified version"""
         # Full USB implementation requires pywin32 or libusb
@@ -135,33 +252,33 @@ class PrinterInterceptor:
         #     if data:
         #         self.on_data_callback(bytes(data))
         
-        while self.running:
-            time.sleep(1)
+        self._stop_event.wait()
     
     def _serial_listener(self, port: str, baudrate: int):
         """Serial port listener with disconnect/reconnect"""
         delay = self._reconnect_delay
         while self.running:
             try:
-                ser = serial.Serial(port, baudrate, timeout=1)
+                ser = serial.Serial(port, baudrate, timeout=FRAME_IDLE_TIMEOUT)
                 delay = self._reconnect_delay
                 if self.on_reconnect:
                     self.on_reconnect(f"serial:{port}")
                 logger.info("Serial port %s opened", port)
                 
-                buffer = b''
+                buffer = _FrameBuffer()
                 
                 while self.running:
                     try:
-                        if ser.in_waiting:
-                            data = ser.read(ser.in_waiting)
-                            buffer += data
-                            if b'\x0a' in buffer or b'\x1d\x56' in buffer:
-                                self.on_data_callback(buffer)
-                                buffer = b''
-                        else:
-                            time.sleep(0.1)
+                        # Blocks until a byte arrives (or the idle timeout), then takes the rest waiting
+                        data = ser.read(1)
+                        if data:
+                            data += ser.read(ser.in_waiting)
+                            self._deliver_frames(buffer, data)
+                        elif buffer:
+                            # Printer went quiet without a cut: treat what we have as a receipt
+                            self._flush_partial(buffer)
                     except serial.SerialException as e:
+                        self._flush_partial(buffer)
                         logger.warning("Serial connection lost: %s", e)
                         if self.on_disconnect:
                             self.on_disconnect(f"serial:{port}")
@@ -177,58 +294,99 @@ class PrinterInterceptor:
             
             if self.running:
                 logger.info("Reconnecting to serial %s in %s seconds...", port, delay)
-                time.sleep(delay)
+                self._stop_event.wait(delay)
                 delay = min(delay * 2, self._reconnect_max_delay)
     
     def _network_listener(self, host: str, port: int):
-        """Network TCP listener; handles client disconnect and accepts new connections"""
+        """Network TCP listener; one selector waits on the server and every printer connection"""
         try:
             server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server.bind((host, port))
-            server.listen(1)
+            server.listen(NETWORK_BACKLOG)
+            server.setblocking(False)
             logger.info("Network server listening on %s:%s", host, port)
             
+            sel = selectors.DefaultSelector()
+            sel.register(server, selectors.EVENT_READ)  # data None marks the listening socket
+            
             while self.running:
-                try:
-                    server.settimeout(1)
-                    conn, addr = server.accept()
-                    if self.on_reconnect:
-                        self.on_reconnect(f"network:{host}:{port}")
-                    logger.info("Connection from %s", addr)
-                    
-                    buffer = b''
-                    while self.running:
-                        try:
-                            data = conn.recv(4096)
-                            if not data:
-                                logger.debug("Client disconnected")
-                                if self.on_disconnect:
-                                    self.on_disconnect(f"network:{addr[0]}:{addr[1]}")
-                                break
-                            buffer += data
-                            if b'\x0a' in buffer or b'\x1d\x56' in buffer:
-                                self.on_data_callback(buffer)
-                                buffer = b''
-                        except (ConnectionResetError, BrokenPipeError, OSError) as e:
-                            logger.warning("Connection lost: %s", e)
-                            if self.on_disconnect:
-                                self.on_disconnect(f"network:{addr[0]}:{addr[1]}")
-                            break
-                    
-                    conn.close()
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    if self.running:
-                        logger.error("Connection error: %s", e)
+                for key, _ in sel.select(timeout=FRAME_IDLE_TIMEOUT):
+                    # One misbehaving connection (or callback) must not stop the other printers
+                    try:
+                        if key.data is None:
+                            self._accept_connection(sel, server, host, port)
+                        else:
+                            self._read_connection(sel, key.fileobj, key.data)
+                    except Exception as e:
+                        logger.error("Error handling printer connection: %s", e)
+                        if key.data is not None:
+                            self._drop_connection(sel, key.fileobj)
+                
+                # Printers that went quiet without a cut: treat what we have as a receipt
+                now = time.monotonic()
+                for key in list(sel.get_map().values()):
+                    printer = key.data
+                    if printer and printer.buffer and now - printer.last_data >= FRAME_IDLE_TIMEOUT:
+                        self._flush_partial(printer.buffer)
             
-            server.close()
+            for key in list(sel.get_map().values()):
+                key.fileobj.close()
+            sel.close()
             
         except Exception as e:
             logger.error("Network server error: %s", e)
     
+    def _accept_connection(self, sel: selectors.BaseSelector, server: socket.socket, host: str, port: int):
+        """Register a newly connected printer with the selector"""
+        try:
+            conn, addr = server.accept()
+        except BlockingIOError:
+            return  # another wakeup already took it
+        except OSError as e:
+            if self.running:
+                logger.error("Connection error: %s", e)
+            return
+        try:
+            conn.setblocking(False)
+            sel.register(conn, selectors.EVENT_READ, _PrinterConnection(addr))
+            if self.on_reconnect:
+                self.on_reconnect(f"network:{host}:{port}")
+        except Exception:
+            self._drop_connection(sel, conn)
+            raise
+        logger.info("Connection from %s", addr)
+    
+    def _read_connection(self, sel: selectors.BaseSelector, conn: socket.socket, printer: '_PrinterConnection'):
+        """Read what a printer sent; on disconnect flush its partial receipt and drop it"""
+        addr = printer.addr
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            logger.warning("Connection lost: %s", e)
+            data = None
+        if data:
+            printer.last_data = time.monotonic()
+            self._deliver_frames(printer.buffer, data)
+            return
+        if data is not None:
+            logger.debug("Client disconnected")
+        self._flush_partial(printer.buffer)
+        self._drop_connection(sel, conn)
+        if self.on_disconnect:
+            self.on_disconnect(f"network:{addr[0]}:{addr[1]}")
+    
+    @staticmethod
+    def _drop_connection(sel: selectors.BaseSelector, conn: socket.socket):
+        """Unregister (if registered) and close one printer connection"""
+        try:
+            sel.unregister(conn)
+        except (KeyError, ValueError):
+            pass
+        conn.close()
+    
     def _windows_port_listener(self, port: str):
         """Windows port listener using pywin32 (COM-style ports only)"""
         if not WIN32_AVAILABLE:
@@ -262,16 +420,14 @@ class PrinterInterceptor:
                 if self.on_reconnect:
                     self.on_reconnect(f"windows:{port}")
                 logger.info("Windows port %s opened", port)
-                buffer = b''
+                buffer = _FrameBuffer()
                 while self.running:
                     try:
                         err, data = win32file.ReadFile(handle, 4096)
                         if data:
-                            buffer += data
-                            if b'\x0a' in buffer or b'\x1d\x56' in buffer:
-                                self.on_data_callback(buffer)
-                                buffer = b''
+                            self._deliver_frames(buffer, data)
                     except Exception as e:
+                        self._flush_partial(buffer)
                         logger.warning("Windows port read error: %s", e)
                         if self.on_disconnect:
                             self.on_disconnect(f"windows:{port}")
@@ -286,26 +442,33 @@ class PrinterInterceptor:
                     self.on_disconnect(f"windows:{port}")
             if self.running:
                 logger.info("Reconnecting to %s in %s seconds...", port, delay)
-                time.sleep(delay)
+                self._stop_event.wait(delay)
                 delay = min(delay * 2, self._reconnect_max_delay)
 
     def _stdin_listener(self):
         """Fallback: Read from stdin (for pipe-based setup)"""
         logger.info("Stdin listener started")
         
-        import sys
-        buffer = b''
+        buffer = _FrameBuffer()
+        # POSIX: wait in select() so stop() is noticed, then read whatever the pipe has.
+        # Windows select() only takes sockets, so read1 blocks there until data or EOF.
+        fd = sys.stdin.fileno() if sys.platform != 'win32' else None
         
         while self.running:
             try:
-                data = sys.stdin.buffer.read(1024)
+                if fd is not None:
+                    readable, _, _ = select.select([fd], [], [], FRAME_IDLE_TIMEOUT)
+                    if not readable:
+                        continue
+                    data = os.read(fd, 4096)
+                else:
+                    data = sys.stdin.buffer.read1(4096)
                 if data:
-                    buffer += data
-                    if b'\x0a' in buffer:
-                        self.on_data_callback(buffer)
-                        buffer = b''
+                    self._deliver_frames(buffer, data)
                 else:
-                    time.sleep(0.1)
+                    # EOF: the pipe has delivered everything it will
+                    self._flush_partial(buffer)
+                    self._stop_event.wait(0.1)
             except Exception as e:
                 logger.error(f"Stdin error: {e}")
                 break
@@ -359,8 +522,7 @@ if __name__ == '__main__':
     
     print("Interceptor running. Press Ctrl+C to stop.")
     try:
-        while True:
-            time.sleep(1)
+        interceptor._stop_event.wait()
     except KeyboardInterrupt:
         print("\nStopping...")
         interceptor.stop()
@@ -3,8 +3,22 @@
 
 import re
 import logging
+import importlib.util
+from collections import defaultdict
+from functools import lru_cache
 from typing import Optional, Dict, List, Tuple
 
+# rapidfuzz - optional; scores the whole catalog in C
+try:
+    from rapidfuzz import fuzz, process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+# numpy - optional; process.cdist returns its score matrix as a numpy array.
+# Only probed here: numpy is imported by rapidfuzz the first time cdist runs.
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
 logger = logging.getLogger(__name__)
 
 # Stub catalog: normalized name -> (product_id, canonical_name)
@@ -15,57 +29,132 @@ STUB_CATALOG: Dict[str, Tuple[str, str]] = {
     "milk": ("SKU004", "Milk 1L"),
 }
 
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
 
+# POS item names repeat constantly (same SKUs all day), so normalizing and matching
+# are memoized on their inputs
+MATCH_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=MATCH_CACHE_SIZE)
 def _normalize(name: str) -> str:
     """Normalize for matching: lowercase, collapse spaces, remove punctuation."""
     if not name:
         return ""
-    s = re.sub(r"[^\w\s]", "", name.lower())
+    s = _PUNCT_RE.sub("", name.lower())
     return " ".join(s.split())
 
 
-def _token_set_ratio(a: str, b: str) -> float:
-    """Simple Jaccard-like token overlap ratio (stub; replace with rapidfuzz/Levenshtein if needed)."""
-    ta, tb = set(_normalize(a).split()), set(_normalize(b).split())
-    if not ta or not tb:
-        return 0.0
-    return len(ta & tb) / max(len(ta), len(tb))
+# Catalog side of the ratio never changes: normalize and tokenize it once at import
+_CATALOG_TOKENS: List[Tuple[str, str, frozenset]] = [
+    (product_id, canonical_name, frozenset(_normalize(canonical_name).split()))
+    for product_id, canonical_name in STUB_CATALOG.values()
+]
+
+
+
+def _build_token_index(catalog_tokens: List[Tuple[str, str, frozenset]]) -> Dict[str, List[int]]:
+    """Map each token to the indexes of the catalog entries containing it."""
+    index = defaultdict(list)
+    for position, (_, _, tokens) in enumerate(catalog_tokens):
+        for token in tokens:
+            index[token].append(position)
+    return dict(index)
+
+
+# Entries sharing no token with the receipt name score 0.0 and can never match,
+# so match_product only visits the ones reachable through this index
+_TOKEN_INDEX = _build_token_index(_CATALOG_TOKENS)
+
+# Normalized canonical names for rapidfuzz, same order as _CATALOG_TOKENS
+_CATALOG_CHOICES: List[str] = [_normalize(canonical_name) for _, canonical_name, _ in _CATALOG_TOKENS]
+
+
+@lru_cache(maxsize=MATCH_CACHE_SIZE)
+def _match_cached(normalized: str, threshold: float) -> Optional[Tuple[str, str]]:
+    """Best (product_id, canonical_name) for an already-normalized name, or None."""
+    best_id, best_name = None, None
+    if RAPIDFUZZ_AVAILABLE:
+        # (choice, score 0-100, index into _CATALOG_CHOICES) or None below the cutoff
+        hit = process.extractOne(normalized, _CATALOG_CHOICES, scorer=fuzz.token_set_ratio,
+                                 score_cutoff=threshold * 100)
+        if hit is not None and hit[1] > 0:
+            best_id, best_name, _ = _CATALOG_TOKENS[hit[2]]
+    else:
+        tokens = frozenset(normalized.split())
+        token_count = len(tokens)
+        best_ratio = 0.0
+        candidates = set()
+        for token in tokens:
+            candidates.update(_TOKEN_INDEX.get(token, ()))
+        # Catalog order, so ties still go to the earlier entry
+        for index in sorted(candidates):
+            product_id, canonical_name, catalog_tokens = _CATALOG_TOKENS[index]
+            # Token overlap ratio; candidates share a token, so neither set is empty
+            ratio = len(tokens & catalog_tokens) / max(token_count, len(catalog_tokens))
+            if ratio >= threshold and ratio > best_ratio:
+                best_ratio = ratio
+                best_id, best_name = product_id, canonical_name
+                if ratio == 1.0:
+                    break  # nothing can beat an exact token match
+    if best_id is None:
+        return None
+    return best_id, best_name
 
 
 def match_product(receipt_name: str, threshold: float = 0.5) -> Optional[Dict[str, str]]:
     """
     Fuzzy match receipt line item name to a product.
     Returns {'product_id': str, 'matched_name': str} or None if no match.
-    Stub implementation using a small in-memory catalog.
+    Stub implementation using a small in-memory catalog; scored with rapidfuzz's
+    token_set_ratio when installed, else by token overlap (shared tokens / larger set).
     """
     if not (receipt_name or "").strip():
         return None
     normalized = _normalize(receipt_name)
     if not normalized:
         return None
-    best_ratio = 0.0
-    best_id, best_name = None, None
-    for catalog_key, (product_id, canonical_name) in STUB_CATALOG.items():
-        ratio = _token_set_ratio(receipt_name, canonical_name)
-        if ratio >= threshold and ratio > best_ratio:
-            best_ratio = ratio
-            best_id, best_name = product_id, canonical_name
-    if best_id is not None:
-        logger.debug("Matched '%s' -> %s (%s)", receipt_name, best_name, best_id)
-        return {"product_id": best_id, "matched_name": best_name}
-    return None
-
-
-def match_items(line_items: List[Dict]) -> List[Dict]:
+    match = _match_cached(normalized, threshold)
+    if match is None:
+        return None
+    product_id, matched_name = match
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Matched '%s' -> %s (%s)", receipt_name, matched_name, product_id)
+    return {"product_id": product_id, "matched_name": matched_name}
+
+
+def _match_many(names: List[str], threshold: float) -> List[Optional[Dict[str, str]]]:
+    """Score every name against the whole catalog in one rapidfuzz.process.cdist call."""
+    queries = [_normalize(name) for name in names]
+    # len(names) x len(catalog) matrix of 0-100 scores, rows computed on all cores
+    scores = process.cdist(queries, _CATALOG_CHOICES, scorer=fuzz.token_set_ratio, workers=-1)
+    best = scores.argmax(axis=1)  # first maximum, same tie-break as extractOne
+    cutoff = threshold * 100
+    matches = []
+    for query, row, index in zip(queries, scores, best):
+        score = row[index]
+        if query and score > 0 and score >= cutoff:
+            product_id, canonical_name, _ = _CATALOG_TOKENS[index]
+            matches.append({"product_id": product_id, "matched_name": canonical_name})
+        else:
+            matches.append(None)
+    return matches
+
+
+def match_items(line_items: List[Dict], threshold: float = 0.5) -> List[Dict]:
     """
     Apply fuzzy match to a list of items (each with 'name' key).
     Adds optional 'product_id' and 'matched_name' when match found.
     """
+    names = [item.get("name") or "" for item in line_items]
+    if RAPIDFUZZ_AVAILABLE and NUMPY_AVAILABLE and len(names) > 1 and _CATALOG_CHOICES:
+        matches = _match_many(names, threshold)
+    else:
+        matches = [match_product(name, threshold) for name in names]
     result = []
-    for item in line_items:
+    for item, match in zip(line_items, matches):
         row = dict(item)
-        name = item.get("name") or ""
-        match = match_product(name)
         if match:
             row["product_id"] = match["product_id"]
             row["matched_name"] = match["matched_name"]
@@ -9,6 +9,9 @@ from .transaction_buffer import TransactionBuffer
 
 logger = logging.getLogger(__name__)
 
+# Unsynced transactions sent per backup API request during replay
+REPLAY_BATCH_SIZE = 200
+
 
 class RecoveryManager:
     """Manages crash recovery and transaction replay"""
@@ -46,8 +49,7 @@ class RecoveryManager:
             logger.info(f"Found {len(unsynced)} unsynced transactions to replay")
             recovery_report['transactions_replayed'] = len(unsynced)
             
-            for tx in unsynced:
-                self._replay_transaction(tx)
+            self._replay_all(unsynced)
         
         # Check for gaps
         gaps = self.buffer.get_pending_gaps()
@@ -79,31 +81,123 @@ class RecoveryManager:
                 "Review transactions during this period."
             )
     
-    def _replay_transaction(self, tx: Dict):
-        """Replay a single transaction to backup API. Never raises; API failure is logged only."""
-        receipt_id = tx.get('receipt_id')
+    def _replay_all(self, unsynced: List[Dict]):
+        """Replay unsynced transactions REPLAY_BATCH_SIZE at a time"""
+        for start in range(0, len(unsynced), REPLAY_BATCH_SIZE):
+            self._replay_batch(unsynced[start:start + REPLAY_BATCH_SIZE])
+    
+    def _replay_batch(self, txs: List[Dict]):
+        """Replay transactions in one sync_batch request, marking them synced in one commit.
+        
+        Falls back to _replay_singly for anything the batch could not confirm.
+        Never raises; API failure is logged only.
+        """
+        sync_batch = getattr(self.sync_client, 'sync_batch', None)
+        if len(txs) < 2 or sync_batch is None:
+            self._replay_singly(txs)
+            return
+        
         try:
-            import json
-            payload = {
-                'receipt_id': receipt_id,
-                'printer_id': tx.get('printer_id'),
-                'items': json.loads(tx.get('items_json', '[]')),
-                'subtotal': tx.get('subtotal', 0),
-                'tax': tx.get('tax', 0),
-                'total': tx.get('total', 0),
-                'timestamp': tx.get('timestamp'),
-                'replay': True,
-            }
-            result = self.sync_client.sync_transaction(payload)
+            # items_json is already encoded; sync_batch splices it in as 'items'
+            result = sync_batch(
+                [self._replay_payload(tx) for tx in txs],
+                items_jsons=[tx.get('items_json') or '[]' for tx in txs],
+            )
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        if not result.get('success'):
+            logger.warning(f"Batch replay of {len(txs)} transactions failed ({result.get('error')}); replaying one at a time")
+            self._replay_singly(txs)
+            return
+        
+        results = result.get('results')
+        if not result.get('failed'):
+            confirmed, retry = txs, []
+        elif results is not None:
+            confirmed = [tx for tx in txs if results.get(tx.get('receipt_id'))]
+            retry = [tx for tx in txs if not results.get(tx.get('receipt_id'))]
+        else:
+            # The response does not say which ones failed; replay the whole batch singly
+            confirmed, retry = [], txs
+        
+        self._record_replayed([(tx['id'], 200) for tx in confirmed])
+        self._replay_singly(retry)
+    
+    def _replay_singly(self, txs: List[Dict]):
+        """Replay transactions one request each (concurrently when the client has sync_many).
+        
+        Outcomes are recorded together: one commit each for the successes, the failures
+        and the final rejections.
+        """
+        if not txs:
+            return
+        sync_many = getattr(self.sync_client, 'sync_many', None)
+        if len(txs) > 1 and sync_many is not None:
+            try:
+                results = sync_many(
+                    [self._replay_payload(tx) for tx in txs],
+                    items_jsons=[tx.get('items_json') or '[]' for tx in txs],
+                )
+            except Exception as e:
+                results = [{'success': False, 'error': str(e)}] * len(txs)
+        else:
+            results = [self._send_replay(tx) for tx in txs]
+        
+        from .sync_client import is_rejected  # urllib3 only once there is something to replay
+        synced, failed, rejected = [], [], []
+        for tx, result in zip(txs, results):
             if result.get('success'):
-                self.buffer.mark_synced(tx['id'], result.get('status_code', 200))
-                logger.info(f"Replayed transaction {receipt_id}")
+                synced.append((tx['id'], result.get('status_code', 200)))
             else:
-                self.buffer.mark_failed(tx['id'], result.get('error', 'Unknown error'))
-                logger.warning(f"Failed to replay {receipt_id}: {result.get('error')}")
+                logger.warning(f"Failed to replay {tx.get('receipt_id')}: {result.get('error')}")
+                # Rejected for good: dead-letter it, as the live sync path does
+                outcomes = rejected if is_rejected(result) else failed
+                outcomes.append((tx['id'], result.get('error') or 'Unknown error'))
+        self._record_replayed(synced)
+        if failed:
+            try:
+                self.buffer.mark_failed_many(failed)
+            except Exception as e:
+                logger.warning(f"Could not record {len(failed)} failed replays: {e}")
+        if rejected:
+            try:
+                self.buffer.mark_rejected_many(rejected)
+            except Exception as e:
+                logger.warning(f"Could not record {len(rejected)} rejected replays: {e}")
+    
+    def _record_replayed(self, synced: List[tuple]):
+        """Mark (tx_id, status_code) pairs synced in one commit"""
+        if not synced:
+            return
+        try:
+            self.buffer.mark_synced_many(synced)
+            logger.info(f"Replayed {len(synced)} transactions")
+        except Exception as e:
+            logger.warning(f"Could not record replay of {len(synced)} transactions: {e}")
+    
+    def _replay_payload(self, tx: Dict) -> Dict:
+        """Backup API payload for a stored transaction, minus 'items' (sent pre-encoded)"""
+        return {
+            'receipt_id': tx.get('receipt_id'),
+            'printer_id': tx.get('printer_id'),
+            'subtotal': tx.get('subtotal', 0),
+            'tax': tx.get('tax', 0),
+            'total': tx.get('total', 0),
+            'timestamp': tx.get('timestamp'),
+            'replay': True,
+        }
+    
+    def _send_replay(self, tx: Dict) -> Dict:
+        """Send a single transaction to backup API. Never raises; failures come back in the result."""
+        try:
+            # items_json is sent as stored, without a decode/re-encode round trip
+            return self.sync_client.sync_transaction(
+                self._replay_payload(tx), items_json=tx.get('items_json') or '[]'
+            )
         except Exception as e:
-            logger.warning(f"Backup API replay failed for {receipt_id} (will retry later): {e}")
-            self.buffer.mark_failed(tx['id'], str(e))
+            logger.warning(f"Backup API replay failed for {tx.get('receipt_id')} (will retry later): {e}")
+            return {'success': False, 'error': str(e)}
     
     def on_shutdown(self):
         """Save state before shutdown"""
@@ -111,30 +205,26 @@ class RecoveryManager:
         self.buffer.save_state('last_sync_time', datetime.now().isoformat())
         
         # Save pending count
-        unsynced = self.buffer.get_unsynced()
-        self.buffer.save_state('pending_on_shutdown', len(unsynced))
+        pending = self.buffer.count_unsynced()
+        self.buffer.save_state('pending_on_shutdown', pending)
         
-        logger.info(f"Shutdown: {len(unsynced)} transactions pending sync")
+        logger.info(f"Shutdown: {pending} transactions pending sync")
     
     def force_replay_all(self) -> int:
         """Force replay of all unsynced transactions"""
         unsynced = self.buffer.get_unsynced()
-        replayed = 0
-        
-        for tx in unsynced:
-            # Reset retry count
-            # (Would need to add this method to buffer)
-            self._replay_transaction(tx)
-            replayed += 1
+        # Reset retry count
+        # (Would need to add this method to buffer)
+        self._replay_all(unsynced)
         
-        return replayed
+        return len(unsynced)
     
     def get_recovery_status(self) -> Dict:
         """Get current recovery status"""
         return {
             'last_sync_time': self.last_sync_time,
             'downtime_logged': self.downtime_logged,
-            'pending_transactions': len(self.buffer.get_unsynced()),
+            'pending_transactions': self.buffer.count_unsynced(),
             'pending_gaps': len(self.buffer.get_pending_gaps()),
             'buffer_stats': self.buffer.get_stats()
         }
@@ -147,7 +237,7 @@ if __name__ == '__main__':
     buffer = TransactionBuffer('test.db')
     
     class StubClient:
-        def sync_transaction(self, tx):
+        def sync_transaction(self, tx, items_json=None):
             return {'success': True, 'status_code': 200}
     
     client = StubClient()
@@ -1,130 +1,219 @@
 # Sync Client - REST API client for RetailStack POS Agent
 # Handles syncing transactions to server
 
-import requests
+import urllib3
+from urllib3.util.retry import Retry
+import asyncio
 import logging
-import time
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from . import fast_json
+
+# httpx + h2 - optional; HTTP/2 multiplexes sync_many's requests over one connection
+try:
+    import httpx
+    import h2  # noqa: F401 - required by httpx for http2=True
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connection pool shared by every request a client makes
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 8
+# Requests sync_many keeps in flight at once
+SYNC_MANY_CONCURRENCY = POOL_MAXSIZE
+
+# Single-transaction responses: accepted, or rejected for good (resending won't help);
+# anything else is treated as a server error worth retrying
+OK_STATUS = frozenset({200, 201, 202, 204})
+TERMINAL_STATUS = frozenset({400, 401, 403, 404, 409, 422})
+
+
+def make_pool() -> urllib3.PoolManager:
+    """Keep-alive connection pools; retries cover connection setup
+    
+    Plain urllib3 rather than requests: a JSON POST needs no cookie jar,
+    hooks or adapter layer, and skipping them cuts the per-request overhead.
+    """
+    return urllib3.PoolManager(
+        num_pools=POOL_CONNECTIONS,
+        maxsize=POOL_MAXSIZE,
+        retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504],
+                      raise_on_status=False),
+    )
+
+
+def _text(response) -> str:
+    """Response body as text, for error messages"""
+    return response.data.decode('utf-8', 'replace')
+
+
+def _json_or_none(response) -> Any:
+    """Decoded JSON body of an accepted response; None if empty or not JSON
+    
+    The status already says the transaction was accepted, so an unexpected
+    body (plain "OK", an HTML page) must not turn that into a failure.
+    """
+    if not response.data:
+        return None
+    try:
+        return fast_json.loads(response.data)
+    except ValueError:
+        return None
+
+
+def is_rejected(result: Dict) -> bool:
+    """True if a sync result is a final rejection (a TERMINAL_STATUS response)
+    
+    Only the server's verdict dead-letters a transaction; timeouts, local errors
+    and unexpected statuses stay pending for another try.
+    """
+    return not result.get('success') and result.get('status_code') in TERMINAL_STATUS
+
+
+def _per_receipt_results(result: Dict) -> Optional[Dict[str, bool]]:
+    """receipt_id -> success from a batch response's 'results' list, or None if it has none"""
+    entries = result.get('results')
+    if not isinstance(entries, list):
+        return None
+    return {
+        entry.get('receipt_id'): bool(entry.get('success'))
+        for entry in entries
+        if isinstance(entry, dict)
+    }
+
 
 class SyncClient:
     """REST API client for syncing transactions to Retail Stack"""
     
     def __init__(self, base_url: str, api_key: str = None, timeout: int = 30,
-                 transactions_path: str = '/api/transactions'):
+                 transactions_path: str = '/api/transactions',
+                 batch_path: str = '/api/transactions/batch',
+                 pool: Optional[urllib3.PoolManager] = None):
         self.base_url = base_url.rstrip('/')
         self.transactions_path = transactions_path if transactions_path.startswith('/') else '/' + transactions_path
+        self.batch_path = batch_path if batch_path.startswith('/') else '/' + batch_path
         self.api_key = api_key
         self.timeout = timeout
-        self.session = requests.Session()
-        
-        if api_key:
-            self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+        self.pool = pool or make_pool()
         
-        self.session.headers.update({
+        # Sent with every request
+        self.headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'RetailStack-POS-Agent/1.0'
-        })
+        }
+        if api_key:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+    
+    def _post(self, endpoint: str, body: bytes, timeout: float = None):
+        """POST an encoded JSON body on the shared pool"""
+        return self.pool.request('POST', endpoint, body=body, headers=self.headers,
+                                 timeout=timeout or self.timeout)
+    
+    def sync_transaction(self, transaction: Dict, items_json: str = None) -> Dict[str, Any]:
+        """Sync a single transaction to backup API
         
-        # Retry settings
-        self.max_retries = 5
-        self.retry_delay = 5  # seconds
+        items_json, if given, is the already-encoded items list and is sent
+        as the payload's 'items' field without re-serializing.
+        """
+        if items_json is None:
+            body = fast_json.dumps(transaction)
+        else:
+            body = fast_json.dumps_with_raw(transaction, items=items_json)
+        return self.sync_transaction_raw(body, transaction.get('receipt_id'))
     
-    def sync_transaction(self, transaction: Dict) -> Dict[str, Any]:
-        """Sync a single transaction to backup API"""
+    def sync_transaction_raw(self, body: bytes, receipt_id: str = None) -> Dict[str, Any]:
+        """Sync a single transaction whose payload is already encoded JSON
+        
+        Posted as is (e.g. a pending_sync row's payload); receipt_id is only
+        used for logging.
+        """
         endpoint = f"{self.base_url}{self.transactions_path}"
         
-        for attempt in range(self.max_retries):
-            try:
-                response = self.session.post(
-                    endpoint,
-                    json=transaction,
-                    timeout=self.timeout
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"Transaction {transaction.get('receipt_id')} synced successfully")
-                    return {
-                        'success': True,
-                        'response': response.json(),
-                        'status_code': response.status_code
-                    }
-                
-                elif response.status_code == 400:
-                    # Bad request - don't retry
-                    logger.error(f"Bad request for {transaction.get('receipt_id')}: {response.text}")
-                    return {
-                        'success': False,
-                        'error': response.text,
-                        'status_code': response.status_code,
-                        'retry': False
-                    }
-                
-                elif response.status_code == 401:
+        # One attempt: a failure stays in pending_sync, whose next_retry schedules the retry
+        try:
+            response = self._post(endpoint, body)
+            
+            code = response.status
+            if code in OK_STATUS:
+                logger.info("Transaction %s synced successfully", receipt_id)
+                return {
+                    'success': True,
+                    'response': _json_or_none(response),
+                    'status_code': code
+                }
+            
+            if code in TERMINAL_STATUS:
+                # Resending the same payload will not help - don't retry
+                if code == 401:
                     logger.error("Authentication failed - check API key")
-                    return {
-                        'success': False,
-                        'error': 'Authentication failed',
-                        'status_code': response.status_code,
-                        'retry': False
-                    }
-                
+                    error = 'Authentication failed'
                 else:
-                    logger.warning(f"Server error {response.status_code}, retry {attempt + 1}/{self.max_retries}")
-                    time.sleep(self.retry_delay * (attempt + 1))
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"Timeout, retry {attempt + 1}/{self.max_retries}")
-                time.sleep(self.retry_delay * (attempt + 1))
-                
-            except requests.exceptions.ConnectionError:
-                logger.warning(f"Connection error, retry {attempt + 1}/{self.max_retries}")
-                time.sleep(self.retry_delay * (attempt + 1))
+                    error = _text(response)
+                    logger.error("Rejected (%s) for %s: %s", code, receipt_id, error)
+                return {'success': False, 'error': error, 'status_code': code, 'retry': False}
+            
+            logger.warning("Server error %s for %s", code, receipt_id)
+            return {'success': False, 'error': f'Server error {code}', 'status_code': code, 'retry': True}
                 
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                return {
-                    'success': False,
-                    'error': str(e),
-                    'retry': False
-                }
-        
-        return {
-            'success': False,
-            'error': 'Max retries exceeded',
-            'status_code': 0,
-            'retry': True
-        }
+        except urllib3.exceptions.TimeoutError:
+            logger.warning("Timeout syncing %s", receipt_id)
+            return {'success': False, 'error': 'Timeout', 'status_code': 0, 'retry': True}
+            
+        except urllib3.exceptions.HTTPError:
+            # Refused/reset connections, and connection setup that ran out of retries
+            logger.warning("Connection error syncing %s", receipt_id)
+            return {'success': False, 'error': 'Connection error', 'status_code': 0, 'retry': True}
+            
+        except Exception as e:
+            # Not a verdict from the server - leave it pending for the next retry
+            logger.error("Unexpected error: %s", e)
+            return {
+                'success': False,
+                'error': str(e),
+                'status_code': 0,
+                'retry': True
+            }
     
-    def sync_batch(self, transactions: list) -> Dict[str, Any]:
-        """Sync multiple transactions"""
-        endpoint = f"{self.base_url}/api/transactions/batch"
+    def sync_batch(self, transactions: list, items_jsons: list = None) -> Dict[str, Any]:
+        """Sync multiple transactions in one request
+        
+        items_jsons, if given, holds each transaction's already-encoded items
+        list (same order) and is spliced in as its 'items' field. On success,
+        'results' maps receipt_id -> success when the server reports per
+        transaction outcomes, else None.
+        """
+        endpoint = f"{self.base_url}{self.batch_path}"
+        if items_jsons is None:
+            body = fast_json.dumps({'transactions': transactions})
+        else:
+            body = b'{"transactions":[' + b','.join(
+                fast_json.dumps_with_raw(transaction, items=items_json)
+                for transaction, items_json in zip(transactions, items_jsons)
+            ) + b']}'
         
         try:
-            response = self.session.post(
-                endpoint,
-                json={'transactions': transactions},
-                timeout=self.timeout * 2
-            )
+            response = self._post(endpoint, body, timeout=self.timeout * 2)
             
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"Batch sync: {result.get('synced', 0)}/{len(transactions)} succeeded")
+            if response.status == 200:
+                result = fast_json.loads(response.data)
+                logger.info("Batch sync: %s/%d succeeded", result.get('synced', 0), len(transactions))
                 return {
                     'success': True,
                     'synced': result.get('synced', 0),
                     'failed': result.get('failed', 0),
+                    'results': _per_receipt_results(result),
                     'details': result
                 }
             else:
                 return {
                     'success': False,
-                    'error': response.text,
-                    'status_code': response.status_code
+                    'error': _text(response),
+                    'status_code': response.status
                 }
                 
         except Exception as e:
@@ -134,14 +223,74 @@ class SyncClient:
                 'error': str(e)
             }
     
+    def sync_many(self, transactions: list, items_jsons: list = None) -> List[Dict[str, Any]]:
+        """POST each transaction on its own, several at a time; results are in input order
+        
+        One attempt per transaction, no retry sleep: whatever fails stays
+        pending for the caller to retry later. Uses an HTTP/2 httpx client
+        when installed, else the keep-alive pool from a few worker threads.
+        """
+        if not transactions:
+            return []
+        if items_jsons is None:
+            bodies = [fast_json.dumps(transaction) for transaction in transactions]
+        else:
+            bodies = [
+                fast_json.dumps_with_raw(transaction, items=items_json)
+                for transaction, items_json in zip(transactions, items_jsons)
+            ]
+        endpoint = f"{self.base_url}{self.transactions_path}"
+        if HTTPX_AVAILABLE:
+            return asyncio.run(self._post_many_http2(endpoint, bodies))
+        with ThreadPoolExecutor(max_workers=min(SYNC_MANY_CONCURRENCY, len(bodies))) as executor:
+            return list(executor.map(lambda body: self._post_once(endpoint, body), bodies))
+    
+    async def _post_many_http2(self, endpoint: str, bodies: List[bytes]) -> List[Dict[str, Any]]:
+        """Concurrent POSTs multiplexed over one HTTP/2 connection"""
+        # One connection when the server speaks HTTP/2; a few if it falls back to HTTP/1.1
+        limits = httpx.Limits(max_connections=POOL_CONNECTIONS, max_keepalive_connections=1)
+        semaphore = asyncio.Semaphore(SYNC_MANY_CONCURRENCY)
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=self.timeout,
+                                     headers=self.headers) as client:
+            async def post(body):
+                async with semaphore:
+                    try:
+                        response = await client.post(endpoint, content=body)
+                    except Exception as e:
+                        return {'success': False, 'error': str(e), 'retry': True}
+                return self._post_result(response.status_code, response.text)
+            return await asyncio.gather(*(post(body) for body in bodies))
+    
+    def _post_once(self, endpoint: str, body: bytes) -> Dict[str, Any]:
+        """One POST on the pool; connection problems become a retryable failure"""
+        try:
+            response = self._post(endpoint, body)
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'retry': True}
+        return self._post_result(response.status, _text(response))
+    
+    @staticmethod
+    def _post_result(code: int, text: str) -> Dict[str, Any]:
+        """Result dict for a single-transaction response status and body"""
+        if code in OK_STATUS:
+            return {'success': True, 'status_code': code}
+        return {
+            'success': False,
+            'error': text,
+            'status_code': code,
+            'retry': code not in TERMINAL_STATUS
+        }
+    
     def check_health(self) -> bool:
         """Check if server is reachable"""
         try:
-            response = self.session.get(
+            response = self.pool.request(
+                'GET',
                 f"{self.base_url}/api/health",
+                headers=self.headers,
                 timeout=5
             )
-            return response.status_code == 200
+            return response.status == 200
         except:
             return False
     
@@ -149,8 +298,7 @@ class SyncClient:
         """Get client status"""
         return {
             'base_url': self.base_url,
-            'connected': self.check_health(),
-            'max_retries': self.max_retries
+            'connected': self.check_health()
         }
 
 
@@ -161,23 +309,39 @@ class StubSyncClient:
     def __init__(self, *args, **kwargs):
         self.sync_count = 0
     
-    def sync_transaction(self, transaction: Dict) -> Dict:
+    def sync_transaction(self, transaction: Dict, items_json: str = None) -> Dict:
         self.sync_count += 1
-        logger.info(f"[STUB] Synced transaction {transaction.get('receipt_id')}")
+        logger.info("[STUB] Synced transaction %s", transaction.get('receipt_id'))
         return {
             'success': True,
             'status_code': 200,
             'response': {'id': self.sync_count}
         }
     
-    def sync_batch(self, transactions: list) -> Dict:
+    def sync_transaction_raw(self, body: bytes, receipt_id: str = None) -> Dict:
+        self.sync_count += 1
+        logger.info("[STUB] Synced transaction %s", receipt_id)
+        return {
+            'success': True,
+            'status_code': 200,
+            'response': {'id': self.sync_count}
+        }
+    
+    def sync_batch(self, transactions: list, items_jsons: list = None) -> Dict:
         self.sync_count += len(transactions)
+        logger.info("[STUB] Synced batch of %d transactions", len(transactions))
         return {
             'success': True,
             'synced': len(transactions),
-            'failed': 0
+            'failed': 0,
+            'results': {transaction.get('receipt_id'): True for transaction in transactions}
         }
     
+    def sync_many(self, transactions: list, items_jsons: list = None) -> List[Dict]:
+        self.sync_count += len(transactions)
+        logger.info("[STUB] Synced %d transactions", len(transactions))
+        return [{'success': True, 'status_code': 200} for _ in transactions]
+    
     def check_health(self) -> bool:
         return True
 
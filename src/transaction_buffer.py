@@ -2,12 +2,31 @@
 # Handles local storage with retry logic
 
 import sqlite3
-import json
+import queue
 import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from dataclasses import asdict
 import os
+from pathlib import Path
+
+from . import fast_json
+
+
+def _has_json_functions() -> bool:
+    """Whether this SQLite build has JSON1 (built in since 3.38, usually compiled in before)"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("SELECT value FROM json_each('[1]')").fetchall()
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+JSON_FUNCTIONS = _has_json_functions()
 
 
 class TransactionBuffer:
@@ -15,15 +34,110 @@ class TransactionBuffer:
     
     DB_PATH = "retailstack_pos.db"
     
-    def __init__(self, db_path: str = None):
+    # Per-connection tuning; journal_mode=WAL is persistent and set once in _init_db.
+    # Individual values can be overridden with the pragmas argument.
+    PRAGMAS = (
+        ('temp_store', 'MEMORY'),
+        ('cache_size', -65536),  # 64 MiB
+        ('mmap_size', 268435456),  # 256 MiB
+        ('busy_timeout', 5000),
+        ('wal_autocheckpoint', 1000),
+        ('foreign_keys', 'ON'),
+    )
+    SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+    # pending_sync backoff after a failed sync: base * 2**retry_count, capped
+    RETRY_BASE_DELAY = 5  # seconds
+    RETRY_MAX_DELAY = 3600  # seconds
+    # Failed syncs after which a transaction is no longer replayed or retried; rows the
+    # backup API rejected outright are set to this straight away (see mark_rejected_many)
+    MAX_SYNC_RETRIES = 5
+    
+    def __init__(self, db_path: str = None, synchronous: str = 'NORMAL',
+                 pragmas: Dict[str, Any] = None, read_pool_size: int = None):
         self.db_path = db_path or self.DB_PATH
+        synchronous = (synchronous or 'NORMAL').upper()
+        if synchronous not in self.SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {synchronous}")
+        # NORMAL in WAL mode only fsyncs at checkpoints; FULL fsyncs every commit.
+        # OFF never fsyncs: fastest, but a power cut can lose recent receipts or
+        # corrupt the database file, so keep it to best-effort deployments.
+        self.synchronous = synchronous
+        self.pragmas = dict(self.PRAGMAS)
+        for name in pragmas or {}:
+            if not name.isidentifier():
+                raise ValueError(f"Invalid pragma name: {name}")
+        self.pragmas.update(pragmas or {})
+        # An in-memory database exists only inside its one connection: no WAL, no reader
+        self.in_memory = self.db_path == ':memory:'
+        # One long-lived writer connection, shared across threads and serialized by
+        # self.lock. Readers borrow read-only connections from a small pool (WAL lets
+        # them run alongside the writer and each other); they are opened on demand.
         self.lock = threading.Lock()
+        self._conn = self._connect()
+        self._read_pool_size = max(1, read_pool_size or min(4, os.cpu_count() or 1))
+        self._read_pool = queue.LifoQueue()  # idle read-only connections
+        self._read_conns = []  # every read-only connection opened, for close()
+        self._read_conns_lock = threading.Lock()
+        if self.in_memory:
+            # Reads go through the writer connection; Row results are still indexable
+            self._conn.row_factory = sqlite3.Row
         self._init_db()
     
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection with the buffer's pragmas applied"""
+        if read_only:
+            uri = f'{Path(self.db_path).resolve().as_uri()}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+    
+    @contextmanager
+    def _reading(self):
+        """Borrow a read-only connection from the pool for the duration of the block"""
+        if self.in_memory:
+            with self.lock:
+                yield self._conn
+            return
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._read_conns_lock:
+                if len(self._read_conns) < self._read_pool_size:
+                    conn = self._connect(read_only=True)
+                    self._read_conns.append(conn)
+            if conn is None:
+                conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+    
+    def close(self):
+        """Close the writer and all pooled reader connections"""
+        with self.lock, self._read_conns_lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns = []
+            self._read_pool = queue.LifoQueue()
+            # Refresh planner statistics for the indexes this session leaned on
+            try:
+                self._conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            self._conn.close()
+    
     def _init_db(self):
         """Initialize database schema"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn
+            if not self.in_memory:
+                conn.execute('PRAGMA journal_mode=WAL')
             cursor = conn.cursor()
             
             # Transactions table
@@ -99,146 +213,378 @@ class TransactionBuffer:
                 )
             ''')
             
+            # Indexes for the hot lookups; the partial ones only hold the few rows
+            # still waiting (unsynced transactions, open gaps)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tx_unsynced
+                ON transactions(created_at, retry_count) WHERE synced = 0
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_tx_printer_ts
+                ON transactions(printer_id, timestamp)
+            ''')
+            # Lets get_stats' MAX(timestamp) read the end of an index instead of the table
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_ts ON transactions(timestamp)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_pending_next ON pending_sync(next_retry)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_pending_tx ON pending_sync(transaction_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_gaps_open ON gaps(resolved) WHERE resolved = 0')
+            
             conn.commit()
-            conn.close()
     
     def add_transaction(self, receipt_id: str, items: List[Dict],
                        total: float, subtotal: float = 0, tax: float = 0,
                        printer_id: str = None, transaction_type: str = 'sale',
-                       is_incomplete: bool = False) -> int:
-        """Add transaction to buffer"""
+                       is_incomplete: bool = False, items_json: str = None) -> int:
+        """Add transaction to buffer (items_json: items already serialized by the caller)"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            items_json = json.dumps(items)
-            timestamp = datetime.now().isoformat()
-            
-            cursor.execute('''
-                INSERT INTO transactions 
-                (receipt_id, printer_id, items_json, subtotal, tax, total, timestamp,
-                 transaction_type, is_incomplete)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (receipt_id, printer_id, items_json, subtotal, tax, total, timestamp,
-                  transaction_type, 1 if is_incomplete else 0))
-            
-            tx_id = cursor.lastrowid
-            # Enqueue to pending_sync for retry scheduling
-            next_retry = datetime.now().isoformat()
-            payload = json.dumps({
-                'receipt_id': receipt_id, 'printer_id': printer_id,
-                'items': items, 'subtotal': subtotal, 'tax': tax, 'total': total,
-                'timestamp': timestamp,
-            })
-            cursor.execute('''
-                INSERT INTO pending_sync (transaction_id, payload, next_retry)
-                VALUES (?, ?, ?)
-            ''', (tx_id, payload, next_retry))
-            conn.commit()
-            conn.close()
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                tx_id = self._insert_transaction(
+                    cursor, receipt_id, items, total, subtotal, tax, printer_id,
+                    transaction_type, is_incomplete, items_json
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
             
             return tx_id
     
-    def get_pending_sync_queue(self, limit: int = 100) -> List[Dict]:
-        """Get pending_sync rows due for retry (next_retry <= now)."""
+    def add_transactions(self, records: List[tuple]) -> List[int]:
+        """Add several transactions in a single SQLite transaction (one commit).
+        
+        Each record is a tuple of ``add_transaction`` positional arguments:
+        (receipt_id, items, total[, subtotal, tax, printer_id, transaction_type,
+        is_incomplete, items_json]).
+        Returns the new transaction ids in record order.
+        """
+        if not records:
+            return []
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                tx_ids = [self._insert_transaction(cursor, *record) for record in records]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            return tx_ids
+    
+    def rollback(self):
+        """Roll back anything a failed write left open on the writer connection"""
+        with self.lock:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+    
+    def _insert_transaction(self, cursor, receipt_id: str, items: List[Dict],
+                            total: float, subtotal: float = 0, tax: float = 0,
+                            printer_id: str = None, transaction_type: str = 'sale',
+                            is_incomplete: bool = False, items_json: str = None) -> int:
+        """Insert a transaction row plus its pending_sync entry; caller commits.
+        
+        items may be dicts or LineItem dataclasses; both serialize the same way.
+        Pass items_json to reuse an existing encoding instead of serializing again.
+        """
+        if items_json is None:
+            items_json = fast_json.dumps(items).decode('utf-8')
+        timestamp = datetime.now().isoformat()
+        
+        cursor.execute('''
+            INSERT INTO transactions 
+            (receipt_id, printer_id, items_json, subtotal, tax, total, timestamp,
+             transaction_type, is_incomplete)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (receipt_id, printer_id, items_json, subtotal, tax, total, timestamp,
+              transaction_type, 1 if is_incomplete else 0))
+        
+        tx_id = cursor.lastrowid
+        # Enqueue to pending_sync for retry scheduling; due as of the insert itself
+        next_retry = timestamp
+        payload = fast_json.dumps_with_raw({
+            'receipt_id': receipt_id, 'printer_id': printer_id,
+            'subtotal': subtotal, 'tax': tax, 'total': total,
+            'timestamp': timestamp,
+        }, items=items_json).decode('utf-8')
+        cursor.execute('''
+            INSERT INTO pending_sync (transaction_id, payload, next_retry)
+            VALUES (?, ?, ?)
+        ''', (tx_id, payload, next_retry))
+        return tx_id
+    
+    def get_pending_sync_queue(self, limit: int = 100, due_before: str = None) -> List[Dict]:
+        """Get pending_sync rows due for retry (next_retry <= due_before, default now).
+        
+        Rows that have failed MAX_SYNC_RETRIES times are left out.
+        """
+        with self._reading() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT * FROM pending_sync
-                WHERE next_retry <= ?
-                ORDER BY next_retry ASC
+                SELECT p.*, t.receipt_id FROM pending_sync p
+                LEFT JOIN transactions t ON t.id = p.transaction_id
+                WHERE p.next_retry <= ? AND p.retry_count < ?
+                ORDER BY p.next_retry ASC
                 LIMIT ?
-            ''', (datetime.now().isoformat(), limit))
+            ''', (due_before or datetime.now().isoformat(), self.MAX_SYNC_RETRIES, limit))
             rows = cursor.fetchall()
-            conn.close()
             return [dict(row) for row in rows]
     
     def update_pending_sync_retry(self, pending_id: int, next_retry: str, increment: bool = True):
         """Update next_retry (and optionally increment retry_count) for a pending_sync row."""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            if increment:
-                cursor.execute('''
-                    UPDATE pending_sync
-                    SET next_retry = ?, retry_count = retry_count + 1
-                    WHERE id = ?
-                ''', (next_retry, pending_id))
-            else:
-                cursor.execute('''
-                    UPDATE pending_sync SET next_retry = ? WHERE id = ?
-                ''', (next_retry, pending_id))
-            conn.commit()
-            conn.close()
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                if increment:
+                    cursor.execute('''
+                        UPDATE pending_sync
+                        SET next_retry = ?, retry_count = retry_count + 1
+                        WHERE id = ?
+                    ''', (next_retry, pending_id))
+                else:
+                    cursor.execute('''
+                        UPDATE pending_sync SET next_retry = ? WHERE id = ?
+                    ''', (next_retry, pending_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     def remove_pending_sync(self, pending_id: int):
         """Remove a row from pending_sync (after successful sync)."""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM pending_sync WHERE id = ?', (pending_id,))
-            conn.commit()
-            conn.close()
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM pending_sync WHERE id = ?', (pending_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    # What replaying a transaction needs; get_unsynced skips the bookkeeping columns
+    UNSYNCED_COLUMNS = ('id', 'receipt_id', 'printer_id', 'items_json',
+                        'subtotal', 'tax', 'total', 'timestamp')
     
     def get_unsynced(self) -> List[Dict]:
-        """Get all unsynced transactions"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+        """Get all unsynced transactions (UNSYNCED_COLUMNS of each)"""
+        columns = self.UNSYNCED_COLUMNS
+        with self._reading() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT * FROM transactions 
-                WHERE synced = 0 AND retry_count < 5
+            cursor.execute(f'''
+                SELECT {', '.join(columns)} FROM transactions 
+                WHERE synced = 0 AND retry_count < ?
                 ORDER BY created_at ASC
-            ''')
-            
-            rows = cursor.fetchall()
-            conn.close()
+            ''', (self.MAX_SYNC_RETRIES,))
             
-            return [dict(row) for row in rows]
+            return [dict(zip(columns, row)) for row in cursor]
     
-    def mark_synced(self, tx_id: int, response_code: int = 200):
-        """Mark transaction as synced"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+    def count_unsynced(self) -> int:
+        """Number of transactions get_unsynced would return, without fetching them"""
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM transactions WHERE synced = 0 AND retry_count < ?',
+                           (self.MAX_SYNC_RETRIES,))
+            return cursor.fetchone()[0]
+    
+    def get_unsynced_summary(self, limit: int = 10) -> List[Dict]:
+        """Oldest unsynced transactions, only the fields the status page shows"""
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
-                UPDATE transactions SET synced = 1 WHERE id = ?
-            ''', (tx_id,))
+                SELECT receipt_id, total, timestamp FROM transactions 
+                WHERE synced = 0 AND retry_count < ?
+                ORDER BY created_at ASC
+                LIMIT ?
+            ''', (self.MAX_SYNC_RETRIES, limit))
             
-            # Log sync
-            cursor.execute('''
-                INSERT INTO sync_log (transaction_id, synced_at, response_code)
-                VALUES (?, ?, ?)
-            ''', (tx_id, datetime.now().isoformat(), response_code))
-            # Remove from pending_sync when synced
-            cursor.execute('DELETE FROM pending_sync WHERE transaction_id = ?', (tx_id,))
-            conn.commit()
-            conn.close()
+            return [
+                {'receipt_id': receipt_id, 'total': total, 'timestamp': timestamp}
+                for receipt_id, total, timestamp in cursor
+            ]
     
-    def mark_failed(self, tx_id: int, error: str):
-        """Mark transaction as failed, increment retry count"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+    def rollup(self, bucket_seconds: int = 86400, since: str = None) -> List[Dict]:
+        """Transaction count and totals per time bucket (default: per day), oldest first.
+        
+        Aggregated inside SQLite, so no rows are materialized in Python.
+        Buckets are aligned to multiples of bucket_seconds of the stored local timestamps;
+        since (an ISO timestamp) limits the range through idx_tx_ts.
+        """
+        if bucket_seconds <= 0:
+            raise ValueError(f"Invalid bucket_seconds: {bucket_seconds}")
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
-                UPDATE transactions 
-                SET sync_error = ?, retry_count = retry_count + 1 
-                WHERE id = ?
-            ''', (error, tx_id))
+                SELECT strftime('%Y-%m-%dT%H:%M:%S', bucket, 'unixepoch'), count, total, tax
+                FROM (
+                    SELECT CAST(strftime('%s', timestamp) AS INTEGER) / ?1 * ?1 AS bucket,
+                           COUNT(*) AS count, SUM(total) AS total, SUM(tax) AS tax
+                    FROM transactions
+                    WHERE timestamp >= ?2
+                    GROUP BY bucket
+                )
+                ORDER BY bucket
+            ''', (bucket_seconds, since or ''))
             
-            conn.commit()
-            conn.close()
+            return [
+                {'bucket_start': bucket_start, 'transactions': count, 'total': total, 'tax': tax}
+                for bucket_start, count, total, tax in cursor
+            ]
+    
+    def mark_synced(self, tx_id: int, response_code: int = 200):
+        """Mark transaction as synced"""
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE transactions SET synced = 1 WHERE id = ?
+                ''', (tx_id,))
+                
+                # Log sync
+                cursor.execute('''
+                    INSERT INTO sync_log (transaction_id, synced_at, response_code)
+                    VALUES (?, ?, ?)
+                ''', (tx_id, datetime.now().isoformat(), response_code))
+                # Remove from pending_sync when synced
+                cursor.execute('DELETE FROM pending_sync WHERE transaction_id = ?', (tx_id,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def mark_synced_many(self, results: List[tuple]):
+        """Mark several transactions as synced in one commit; results are (tx_id, response_code)"""
+        if not results:
+            return
+        synced_at = datetime.now().isoformat()
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                if JSON_FUNCTIONS:
+                    # The whole batch as one JSON parameter: each statement runs once
+                    # instead of once per transaction
+                    ids = fast_json.dumps([tx_id for tx_id, _ in results]).decode('utf-8')
+                    cursor.execute('''
+                        UPDATE transactions SET synced = 1
+                        WHERE id IN (SELECT value FROM json_each(?))
+                    ''', (ids,))
+                    cursor.execute('''
+                        INSERT INTO sync_log (transaction_id, synced_at, response_code)
+                        SELECT json_extract(value, '$[0]'), ?, json_extract(value, '$[1]')
+                        FROM json_each(?)
+                    ''', (synced_at, fast_json.dumps([list(result) for result in results]).decode('utf-8')))
+                    cursor.execute('''
+                        DELETE FROM pending_sync
+                        WHERE transaction_id IN (SELECT value FROM json_each(?))
+                    ''', (ids,))
+                else:
+                    cursor.executemany('UPDATE transactions SET synced = 1 WHERE id = ?',
+                                       [(tx_id,) for tx_id, _ in results])
+                    cursor.executemany('''
+                        INSERT INTO sync_log (transaction_id, synced_at, response_code)
+                        VALUES (?, ?, ?)
+                    ''', [(tx_id, synced_at, code) for tx_id, code in results])
+                    cursor.executemany('DELETE FROM pending_sync WHERE transaction_id = ?',
+                                       [(tx_id,) for tx_id, _ in results])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def mark_failed(self, tx_id: int, error: str):
+        """Mark transaction as failed, increment retry count and back off its next retry"""
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE transactions 
+                    SET sync_error = ?, retry_count = retry_count + 1 
+                    WHERE id = ?
+                ''', (error, tx_id))
+                self._reschedule_pending_sync(cursor, tx_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def mark_failed_many(self, failures: List[tuple]):
+        """Mark several transactions as failed in one commit; failures are (tx_id, error)"""
+        if not failures:
+            return
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.executemany('''
+                    UPDATE transactions 
+                    SET sync_error = ?, retry_count = retry_count + 1 
+                    WHERE id = ?
+                ''', [(error, tx_id) for tx_id, error in failures])
+                for tx_id, _ in failures:
+                    self._reschedule_pending_sync(cursor, tx_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def mark_rejected_many(self, rejections: List[tuple]):
+        """Stop retrying transactions the backup API rejected for good; rejections are (tx_id, error).
+        
+        Rows stay in the database with their error (a dead letter), but their retry
+        counts jump to MAX_SYNC_RETRIES, so neither replay nor the pending retry picks
+        them up again.
+        """
+        if not rejections:
+            return
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.executemany('''
+                    UPDATE transactions 
+                    SET sync_error = ?, retry_count = MAX(retry_count, ?) 
+                    WHERE id = ?
+                ''', [(error, self.MAX_SYNC_RETRIES, tx_id) for tx_id, error in rejections])
+                cursor.executemany('''
+                    UPDATE pending_sync SET retry_count = MAX(retry_count, ?)
+                    WHERE transaction_id = ?
+                ''', [(self.MAX_SYNC_RETRIES, tx_id) for tx_id, _ in rejections])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def _reschedule_pending_sync(self, cursor, tx_id: int):
+        """Push a transaction's pending_sync retry out exponentially; caller commits"""
+        cursor.execute('SELECT retry_count FROM pending_sync WHERE transaction_id = ?', (tx_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        delay = min(self.RETRY_BASE_DELAY * 2 ** min(row[0], 16), self.RETRY_MAX_DELAY)
+        next_retry = (datetime.now() + timedelta(seconds=delay)).isoformat()
+        cursor.execute('''
+            UPDATE pending_sync
+            SET next_retry = ?, retry_count = retry_count + 1
+            WHERE transaction_id = ?
+        ''', (next_retry, tx_id))
     
     def get_receipt_ids(self, printer_id: str = None) -> List[str]:
         """Get all receipt IDs for gap detection"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             if printer_id:
@@ -252,86 +598,103 @@ class TransactionBuffer:
                 ''')
             
             rows = cursor.fetchall()
-            conn.close()
             
             return [row[0] for row in rows]
     
-    def log_gap(self, printer_id: str, expected: str, missing: str):
-        """Log a sequence gap"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+    def get_last_receipt_id(self, printer_id: str = None) -> Optional[str]:
+        """Most recent receipt ID, without reading every other one"""
+        with self._reading() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT INTO gaps (printer_id, expected_receipt_id, missing_receipt_id, detected_at)
-                VALUES (?, ?, ?, ?)
-            ''', (printer_id, expected, missing, datetime.now().isoformat()))
+            if printer_id:
+                cursor.execute('''
+                    SELECT receipt_id FROM transactions
+                    WHERE printer_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1
+                ''', (printer_id,))
+            else:
+                cursor.execute('''
+                    SELECT receipt_id FROM transactions ORDER BY timestamp DESC, id DESC LIMIT 1
+                ''')
             
-            conn.commit()
-            conn.close()
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
+    def log_gap(self, printer_id: str, expected: str, missing: str):
+        """Log a sequence gap"""
+        with self.lock:
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO gaps (printer_id, expected_receipt_id, missing_receipt_id, detected_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (printer_id, expected, missing, datetime.now().isoformat()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     def get_pending_gaps(self) -> List[Dict]:
         """Get unresolved gaps"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             cursor.execute('SELECT * FROM gaps WHERE resolved = 0')
             
             rows = cursor.fetchall()
-            conn.close()
             
             return [dict(row) for row in rows]
     
     def resolve_gap(self, gap_id: int, note: str):
         """Mark gap as resolved"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE gaps SET resolved = 1, resolution_note = ? WHERE id = ?
-            ''', (note, gap_id))
-            
-            conn.commit()
-            conn.close()
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE gaps SET resolved = 1, resolution_note = ? WHERE id = ?
+                ''', (note, gap_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     def save_state(self, key: str, value: Any):
         """Save state key-value"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO state (key, value, updated_at)
-                VALUES (?, ?, ?)
-            ''', (key, json.dumps(value), datetime.now().isoformat()))
-            
-            conn.commit()
-            conn.close()
+            conn = self._conn
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT OR REPLACE INTO state (key, value, updated_at)
+                    VALUES (?, ?, ?)
+                ''', (key, fast_json.dumps(value).decode('utf-8'), datetime.now().isoformat()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
     
     def load_state(self, key: str, default: Any = None) -> Any:
         """Load state value"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             cursor.execute('SELECT value FROM state WHERE key = ?', (key,))
             row = cursor.fetchone()
-            conn.close()
             
             if row:
                 try:
-                    return json.loads(row[0])
+                    return fast_json.loads(row[0])
                 except:
                     return row[0]
             return default
     
     def get_stats(self) -> Dict:
         """Get buffer statistics"""
-        with self.lock:
-            conn = sqlite3.connect(self.db_path)
+        with self._reading() as conn:
             cursor = conn.cursor()
             
             stats = {}
@@ -351,7 +714,6 @@ class TransactionBuffer:
             cursor.execute('SELECT MAX(timestamp) FROM transactions WHERE synced = 1')
             stats['last_sync'] = cursor.fetchone()[0]
             
-            conn.close()
             return stats
 
 
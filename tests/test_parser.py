@@ -72,23 +72,82 @@ class TestESCPOSParser:
         
         # Should handle comma as thousand separator
         assert any(item.unit_price >= 1500 for item in result.items)
+    
+    def test_parse_many_columns(self):
+        """Test parsing several receipts into column-wise arrays"""
+        batch = self.parser.parse_many([
+            b"Item 1         2 x 500\nTOTAL: 1000\nReceipt #1001",
+            b"Item A            1,500\nItem B    1 x 250\nTOTAL: 1750\nReceipt #1002",
+        ])
+        
+        assert len(batch) == 2
+        assert batch.receipt_ids == ['1001', '1002']
+        assert batch.totals_sum() == 2750.0
+        assert list(batch.item_offsets) == [0, 1, 3]
+        assert list(batch.quantities) == [2, 1, 1]
+        assert batch.item_names[1] == 'Item A'
+        
+        batch.append(Transaction(receipt_id='1003', total=1075.0, subtotal=1000.0, tax=75.0))
+        
+        assert list(batch.taxes) == [0.0, 0.0, 75.0]
+        assert list(batch.subtotals)[2] == 1000.0
+        assert list(batch.item_offsets) == [0, 1, 3, 3]
+    
+    def test_parse_file(self, tmp_path):
+        """Test parsing a captured log split on the paper cut command"""
+        log = tmp_path / 'capture.bin'
+        log.write_bytes(
+            b"Item 1    2 x 500\nTOTAL: 1000\nReceipt #1001\n\x1dVA\x03"
+            b"Item 2       1,500\nTOTAL: 1500\nReceipt #1002\n\x1dV\x00"
+            b"Receipt #1003\nTOTAL: 250\n"
+        )
+        
+        transactions = list(self.parser.parse_file(str(log)))
+        
+        assert [tx.receipt_id for tx in transactions] == ['1001', '1002', '1003']
+        assert [tx.total for tx in transactions] == [1000.0, 1500.0, 250.0]
+    
+    def test_parse_file_truncated_cut(self, tmp_path):
+        """Test that a capture ending mid-cut is framed like the printer interceptor frames it"""
+        from src.printer_interceptor import _FrameBuffer
+        
+        for tail in (b'\x1dVA', b'\x1dVB', b'\x1dV'):
+            capture = b"Receipt #1001\nTOTAL: 1000\n\x1dVA\x03Receipt #1002\nTOTAL: 1500\n" + tail
+            log = tmp_path / 'capture.bin'
+            log.write_bytes(capture)
+            frame_buffer = _FrameBuffer()
+            frames = frame_buffer.feed(capture) + [frame_buffer.take()]
+            
+            transactions = list(self.parser.parse_file(str(log)))
+            
+            assert frames[1].endswith(tail)
+            assert [tx.receipt_id for tx in transactions] == ['1001', '1002']
+            assert [tx.raw_data for tx in transactions] == [self.parser.parse(frame).raw_data for frame in frames]
 
 
 class TestTransactionBuffer:
     """Test transaction buffer"""
     
-    def test_add_transaction(self):
-        """Test adding transaction"""
+    @pytest.fixture
+    def buffer(self, tmp_path):
+        """File-backed buffer in a per-test directory, closed afterwards"""
         from src.transaction_buffer import TransactionBuffer
-        import os
         
-        # Use test db
-        db_path = 'test_buffer.db'
-        if os.path.exists(db_path):
-            os.remove(db_path)
-        
-        buffer = TransactionBuffer(db_path)
+        buffer = TransactionBuffer(str(tmp_path / 'buffer.db'))
+        yield buffer
+        buffer.close()
+    
+    @pytest.fixture
+    def memory_buffer(self, request):
+        """In-memory buffer (pragmas from indirect parametrization, if any), closed afterwards"""
+        from src.transaction_buffer import TransactionBuffer
         
+        buffer = TransactionBuffer(':memory:', pragmas=getattr(request, 'param', None))
+        yield buffer
+        buffer.close()
+    
+    def test_add_transaction(self, buffer):
+        """Test adding transaction"""
         items = [
             {'name': 'Item 1', 'quantity': 2, 'unit_price': 500, 'total': 1000}
         ]
@@ -96,21 +155,9 @@ class TestTransactionBuffer:
         tx_id = buffer.add_transaction('RCT001', items, 1000)
         
         assert tx_id > 0
-        
-        # Cleanup
-        os.remove(db_path)
     
-    def test_get_unsynced(self):
+    def test_get_unsynced(self, buffer):
         """Test getting unsynced transactions"""
-        from src.transaction_buffer import TransactionBuffer
-        import os
-        
-        db_path = 'test_unsynced.db'
-        if os.path.exists(db_path):
-            os.remove(db_path)
-        
-        buffer = TransactionBuffer(db_path)
-        
         # Add transactions
         items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
         buffer.add_transaction('RCT001', items, 100)
@@ -119,9 +166,244 @@ class TestTransactionBuffer:
         unsynced = buffer.get_unsynced()
         
         assert len(unsynced) == 2
+    
+    def test_add_transactions_batch(self, buffer):
+        """Test adding several transactions in one commit"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = buffer.add_transactions([
+            ('RCT001', items, 100),
+            ('RCT002', items, 100, 100, 0, 'p1'),
+        ])
+        
+        assert len(tx_ids) == 2
+        assert tx_ids[1] > tx_ids[0]
+        assert buffer.get_stats()['pending_sync_queue'] == 2
+        assert buffer.get_receipt_ids('p1') == ['RCT002']
+    
+    def test_add_transaction_with_line_items(self, buffer):
+        """Test that LineItem dataclasses are stored like plain dicts"""
+        import json
         
-        # Cleanup
-        os.remove(db_path)
+        items = [LineItem(name='Item 1', quantity=2, unit_price=500.0, total=1000.0)]
+        buffer.add_transaction('RCT001', items, 1000)
+        
+        unsynced = buffer.get_unsynced()
+        
+        assert json.loads(unsynced[0]['items_json']) == [
+            {'name': 'Item 1', 'quantity': 2, 'unit_price': 500.0, 'total': 1000.0}
+        ]
+    
+    def test_add_transaction_with_items_json(self, buffer):
+        """Test that precomputed items JSON is stored and reused in the sync payload"""
+        import json
+        
+        items_json = '[{"name":"Item 1","quantity":2,"unit_price":500.0,"total":1000.0}]'
+        buffer.add_transaction('RCT001', None, 1000, items_json=items_json)
+        
+        unsynced = buffer.get_unsynced()
+        pending = buffer.get_pending_sync_queue()
+        
+        assert unsynced[0]['items_json'] == items_json
+        payload = json.loads(pending[0]['payload'])
+        assert payload['items'] == json.loads(items_json)
+        assert payload['receipt_id'] == 'RCT001'
+        assert payload['total'] == 1000
+    
+    def test_failed_write_rolls_back(self, buffer):
+        """Test that a failed single write leaves no open transaction behind"""
+        import sqlite3
+        
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        with pytest.raises(sqlite3.Error):
+            buffer.add_transaction('RCT001', items, 100, printer_id=object())
+        
+        assert not buffer._conn.in_transaction
+        buffer.add_transactions([('RCT002', items, 100)])
+        assert [tx['receipt_id'] for tx in buffer.get_unsynced()] == ['RCT002']
+
+    def test_mark_synced_many(self, buffer):
+        """Test marking a batch of transactions synced in one commit"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100), ('RCT003', items, 100)])
+        buffer.mark_synced_many([(tx_ids[0], 200), (tx_ids[2], 201)])
+        
+        stats = buffer.get_stats()
+        
+        assert [tx['receipt_id'] for tx in buffer.get_unsynced()] == ['RCT002']
+        assert stats['pending_sync'] == 1
+        assert stats['pending_sync_queue'] == 1
+    
+    def test_get_unsynced_summary(self, memory_buffer):
+        """Test the status page's narrow, limited view of unsynced transactions"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        memory_buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 200), ('RCT003', items, 300)])
+        
+        summary = memory_buffer.get_unsynced_summary(limit=2)
+        
+        assert [tx['receipt_id'] for tx in summary] == ['RCT001', 'RCT002']
+        assert set(summary[0]) == {'receipt_id', 'total', 'timestamp'}
+        assert summary[1]['total'] == 200
+    
+    def test_mark_failed_backs_off_pending_sync(self, memory_buffer):
+        """Test that a failed sync is not due again until its backoff passes"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = memory_buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100)])
+        memory_buffer.mark_failed(tx_ids[0], 'Server error 503')
+        
+        pending = memory_buffer.get_pending_sync_queue()
+        
+        assert [row['transaction_id'] for row in pending] == [tx_ids[1]]
+        assert memory_buffer.get_stats()['pending_sync_queue'] == 2
+    
+    def test_mark_failed_many(self, buffer):
+        """Test recording several failed syncs in one commit"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100), ('RCT003', items, 100)])
+        buffer.mark_failed_many([(tx_ids[0], 'Timeout'), (tx_ids[2], 'Server error 503')])
+        
+        rows = buffer._conn.execute('''
+            SELECT t.sync_error, t.retry_count, p.retry_count FROM transactions t
+            JOIN pending_sync p ON p.transaction_id = t.id ORDER BY t.id
+        ''').fetchall()
+        
+        assert rows == [('Timeout', 1, 1), (None, 0, 0), ('Server error 503', 1, 1)]
+        assert [row['transaction_id'] for row in buffer.get_pending_sync_queue()] == [tx_ids[1]]
+        assert buffer.count_unsynced() == 3
+    
+    def test_rollup(self, memory_buffer):
+        """Test per-day totals aggregated in SQLite"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = memory_buffer.add_transactions([('RCT001', items, 100, 100, 5), ('RCT002', items, 50), ('RCT003', items, 25)])
+        memory_buffer._conn.execute("UPDATE transactions SET timestamp = '2026-10-14T23:59:59.500000' WHERE id = ?", (tx_ids[0],))
+        memory_buffer._conn.execute("UPDATE transactions SET timestamp = '2026-10-15T08:00:00' WHERE id != ?", (tx_ids[0],))
+        memory_buffer._conn.commit()
+        
+        rollup = memory_buffer.rollup()
+        
+        assert rollup == [
+            {'bucket_start': '2026-10-14T00:00:00', 'transactions': 1, 'total': 100.0, 'tax': 5.0},
+            {'bucket_start': '2026-10-15T00:00:00', 'transactions': 2, 'total': 75.0, 'tax': 0.0},
+        ]
+        assert memory_buffer.rollup(3600, since='2026-10-15')[0]['bucket_start'] == '2026-10-15T08:00:00'
+    
+    @pytest.mark.parametrize('memory_buffer', [{'cache_size': -20000}], indirect=True)
+    def test_in_memory_buffer(self, memory_buffer):
+        """Test that ':memory:' works without WAL or a separate reader"""
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        memory_buffer.add_transaction('RCT001', items, 100)
+        
+        assert memory_buffer.get_stats()['total_transactions'] == 1
+        assert memory_buffer.get_unsynced()[0]['receipt_id'] == 'RCT001'
+        assert memory_buffer._conn.execute('PRAGMA cache_size').fetchone()[0] == -20000
+
+
+class TestRecoveryManager:
+    """Test replay of unsynced transactions"""
+    
+    @pytest.fixture
+    def buffer(self):
+        """In-memory buffer holding three unsynced transactions"""
+        from src.transaction_buffer import TransactionBuffer
+        
+        buffer = TransactionBuffer(':memory:')
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 200), ('RCT003', items, 300)])
+        yield buffer
+        buffer.close()
+    
+    class StubClient:
+        """Backup API stub: a canned sync_batch result, single sends succeed only for ok_single
+        and are rejected for good (422) for rejected_single"""
+        
+        def __init__(self, batch_result, ok_single=(), rejected_single=()):
+            self.batch_result = batch_result
+            self.ok_single = set(ok_single)
+            self.rejected_single = set(rejected_single)
+            self.batches = []
+            self.single = []
+        
+        def sync_batch(self, transactions, items_jsons=None):
+            self.batches.append([transaction['receipt_id'] for transaction in transactions])
+            return self.batch_result
+        
+        def sync_transaction(self, transaction, items_json=None):
+            self.single.append(transaction['receipt_id'])
+            if transaction['receipt_id'] in self.ok_single:
+                return {'success': True, 'status_code': 201}
+            if transaction['receipt_id'] in self.rejected_single:
+                return {'success': False, 'error': 'invalid total', 'status_code': 422, 'retry': False}
+            return {'success': False, 'error': 'Server error 503', 'retry': True}
+    
+    @staticmethod
+    def _state(buffer):
+        """receipt_id -> (synced, retry_count, pending_sync retry_count or None)"""
+        rows = buffer._conn.execute('''
+            SELECT t.receipt_id, t.synced, t.retry_count, p.retry_count FROM transactions t
+            LEFT JOIN pending_sync p ON p.transaction_id = t.id
+        ''')
+        return {row[0]: tuple(row[1:]) for row in rows}
+    
+    def test_replay_batch_all_synced(self, buffer):
+        """Test that a fully successful batch marks every transaction synced"""
+        from src.recovery_manager import RecoveryManager
+        
+        client = self.StubClient({'success': True, 'synced': 3, 'failed': 0})
+        RecoveryManager(buffer, client).force_replay_all()
+        
+        assert client.batches == [['RCT001', 'RCT002', 'RCT003']]
+        assert client.single == []
+        assert self._state(buffer) == {r: (1, 0, None) for r in ('RCT001', 'RCT002', 'RCT003')}
+    
+    def test_replay_batch_partial_results(self, buffer):
+        """Test that per-receipt results confirm some and retry only the rest singly"""
+        from src.recovery_manager import RecoveryManager
+        
+        client = self.StubClient({'success': True, 'synced': 1, 'failed': 2,
+                                  'results': {'RCT001': True, 'RCT002': False, 'RCT003': False}},
+                                 ok_single={'RCT003'})
+        RecoveryManager(buffer, client).force_replay_all()
+        
+        assert client.single == ['RCT002', 'RCT003']
+        assert self._state(buffer) == {
+            'RCT001': (1, 0, None),
+            'RCT002': (0, 1, 1),
+            'RCT003': (1, 0, None),
+        }
+    
+    def test_replay_batch_failure_falls_back_to_singles(self, buffer):
+        """Test that a failed batch request replays every transaction one at a time"""
+        from src.recovery_manager import RecoveryManager
+        
+        client = self.StubClient({'success': False, 'error': 'Server error 502'}, ok_single={'RCT001'})
+        RecoveryManager(buffer, client).force_replay_all()
+        
+        assert client.single == ['RCT001', 'RCT002', 'RCT003']
+        assert self._state(buffer) == {
+            'RCT001': (1, 0, None),
+            'RCT002': (0, 1, 1),
+            'RCT003': (0, 1, 1),
+        }
+        assert buffer.count_unsynced() == 2
+    
+    def test_replay_dead_letters_rejections(self, buffer):
+        """Test that a final rejection during replay is dead-lettered, not retried"""
+        from src.recovery_manager import RecoveryManager
+        
+        client = self.StubClient({'success': False, 'error': 'Server error 502'},
+                                 ok_single={'RCT001'}, rejected_single={'RCT002'})
+        recovery = RecoveryManager(buffer, client)
+        recovery.force_replay_all()
+        
+        assert self._state(buffer) == {
+            'RCT001': (1, 0, None),
+            'RCT002': (0, buffer.MAX_SYNC_RETRIES, buffer.MAX_SYNC_RETRIES),
+            'RCT003': (0, 1, 1),
+        }
+        
+        client.single = []
+        recovery.force_replay_all()
+        
+        assert client.single == ['RCT003']
 
 
 class TestGapDetector:
@@ -175,5 +457,479 @@ class TestGapDetector:
         assert len(buffer.gaps) == 1
 
 
+class TestPrinterInterceptor:
+    """Test receipt framing and the network listener"""
+    
+    def test_network_listener_survives_callback_error(self):
+        """Test that a failing connection callback drops only that connection"""
+        import socket
+        import time
+        from src.printer_interceptor import PrinterInterceptor
+        
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        
+        frames = []
+        connections = []
+        
+        def on_reconnect(source):
+            connections.append(source)
+            if len(connections) == 1:
+                raise RuntimeError('callback failed')
+        
+        interceptor = PrinterInterceptor(frames.append, on_reconnect=on_reconnect)
+        interceptor.start_network('127.0.0.1', port)
+        try:
+            for receipt in (b'Receipt #1001\x1dV\x00', b'Receipt #1002\x1dV\x00'):
+                deadline = time.monotonic() + 5
+                while True:
+                    try:
+                        client = socket.create_connection(('127.0.0.1', port), timeout=1)
+                        break
+                    except ConnectionRefusedError:
+                        if time.monotonic() > deadline:
+                            raise
+                        time.sleep(0.05)
+                with client:
+                    try:
+                        client.sendall(receipt)
+                    except OSError:
+                        pass  # the first connection may already have been dropped
+                    time.sleep(0.2)
+            
+            deadline = time.monotonic() + 5
+            while not frames and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            interceptor.stop()
+        
+        assert len(connections) == 2
+        assert frames == [b'Receipt #1002\x1dV\x00']
+    
+    def test_frame_cut_split_across_feeds(self):
+        """Test a cut command whose GS and V bytes arrive in different reads"""
+        from src.printer_interceptor import _FrameBuffer
+        
+        buffer = _FrameBuffer()
+        
+        assert buffer.feed(b'Receipt #1001\x1d') == []
+        assert buffer.feed(b'V\x00Receipt #10') == [b'Receipt #1001\x1dV\x00']
+        assert bytes(buffer.data) == b'Receipt #10'
+    
+    def test_frame_cut_feed_byte_in_later_chunk(self):
+        """Test that GS V A / GS V B wait for their feed byte before cutting"""
+        from src.printer_interceptor import _FrameBuffer
+        
+        for mode in (b'A', b'B'):
+            buffer = _FrameBuffer()
+            
+            assert buffer.feed(b'Receipt #1001\x1dV' + mode) == []
+            assert buffer.feed(b'\x03Receipt') == [b'Receipt #1001\x1dV' + mode + b'\x03']
+            assert bytes(buffer.data) == b'Receipt'
+    
+    def test_frame_several_cuts_in_one_feed(self):
+        """Test that one read completing several receipts returns them all, in order"""
+        from src.printer_interceptor import _FrameBuffer
+        
+        buffer = _FrameBuffer()
+        
+        frames = buffer.feed(b'one\x1dV\x00two\x1dVA\x05three\x1dV\x01four')
+        
+        assert frames == [b'one\x1dV\x00', b'two\x1dVA\x05', b'three\x1dV\x01']
+        assert bytes(buffer.data) == b'four'
+    
+    def test_frame_take_partial(self):
+        """Test that take() returns an unterminated receipt and empties the buffer"""
+        from src.printer_interceptor import _FrameBuffer
+        
+        buffer = _FrameBuffer()
+        buffer.feed(b'Receipt #1001\x1d')
+        
+        assert buffer.take() == b'Receipt #1001\x1d'
+        assert len(buffer) == 0
+        assert buffer.feed(b'V\x00') == []
+        assert buffer.feed(b'next\x1dV\x00') == [b'V\x00next\x1dV\x00']
+
+
+class TestSyncClient:
+    """Test backup API response handling"""
+    
+    class StubPool:
+        """Stands in for urllib3.PoolManager: returns a canned status or raises"""
+        
+        def __init__(self, status=200, data=b'', error=None):
+            self.status = status
+            self.data = data
+            self.error = error
+            self.requests = []
+        
+        def request(self, method, url, body=None, headers=None, timeout=None):
+            self.requests.append((method, url, body))
+            if self.error is not None:
+                raise self.error
+            return self
+    
+    def _client(self, **pool_args):
+        from src.sync_client import SyncClient
+        
+        return SyncClient('http://backup.test', pool=self.StubPool(**pool_args))
+    
+    @pytest.mark.parametrize('status', [200, 201, 202, 204])
+    def test_ok_status(self, status):
+        """Test that every accepted status counts as synced"""
+        client = self._client(status=status, data=b'{"id":7}' if status != 204 else b'')
+        
+        result = client.sync_transaction({'receipt_id': 'RCT001', 'total': 100}, items_json='[]')
+        
+        assert result['success'] is True
+        assert result['status_code'] == status
+        assert result['response'] == ({'id': 7} if status != 204 else None)
+        assert client.pool.requests[0][2] == b'{"items":[],"receipt_id":"RCT001","total":100}'
+    
+    @pytest.mark.parametrize('data', [b'OK', b'<html>Accepted</html>'])
+    def test_ok_status_non_json_body(self, data):
+        """Test that an accepted response is still a success when its body is not JSON"""
+        result = self._client(status=201, data=data).sync_transaction_raw(b'{}', 'RCT001')
+        
+        assert result == {'success': True, 'response': None, 'status_code': 201}
+    
+    def test_unexpected_error_retries(self):
+        """Test that a local error is retryable, not a rejection"""
+        result = self._client(error=RuntimeError('boom')).sync_transaction_raw(b'{}', 'RCT001')
+        
+        assert result == {'success': False, 'error': 'boom', 'status_code': 0, 'retry': True}
+
+    @pytest.mark.parametrize('status', [400, 401, 403, 404, 409, 422])
+    def test_terminal_status(self, status):
+        """Test that rejections are final: no retry"""
+        result = self._client(status=status, data=b'bad payload').sync_transaction_raw(b'{}', 'RCT001')
+        
+        assert result['success'] is False
+        assert result['retry'] is False
+        assert result['status_code'] == status
+    
+    @pytest.mark.parametrize('status', [500, 502, 503, 504])
+    def test_server_error_retries(self, status):
+        """Test that server errors are reported as retryable"""
+        result = self._client(status=status).sync_transaction_raw(b'{}', 'RCT001')
+        
+        assert result == {'success': False, 'error': f'Server error {status}', 'status_code': status, 'retry': True}
+    
+    def test_timeout_and_connection_error_retry(self):
+        """Test that timeouts and connection failures are retryable"""
+        import urllib3
+        
+        timeout = self._client(error=urllib3.exceptions.ConnectTimeoutError()).sync_transaction_raw(b'{}')
+        refused = self._client(error=urllib3.exceptions.ProtocolError('Connection aborted')).sync_transaction_raw(b'{}')
+        
+        assert timeout == {'success': False, 'error': 'Timeout', 'status_code': 0, 'retry': True}
+        assert refused == {'success': False, 'error': 'Connection error', 'status_code': 0, 'retry': True}
+    
+    def test_post_result(self):
+        """Test the status classification shared by sync_many"""
+        from src.sync_client import SyncClient
+        
+        assert SyncClient._post_result(201, '') == {'success': True, 'status_code': 201}
+        assert SyncClient._post_result(409, 'dup')['retry'] is False
+        assert SyncClient._post_result(503, 'busy')['retry'] is True
+    
+    @pytest.mark.parametrize('orjson', [True, False])
+    def test_dumps_with_raw_matches_dumps(self, orjson, monkeypatch):
+        """Test that splicing pre-encoded items gives the same JSON as encoding them"""
+        from src import fast_json
+        
+        monkeypatch.setattr(fast_json, 'ORJSON_AVAILABLE', orjson and fast_json.ORJSON_AVAILABLE)
+        items = [LineItem(name='Café', quantity=2, unit_price=500.0, total=1000.0)]
+        payload = {'receipt_id': 'RCT001', 'total': 1000.0, 'replay': False}
+        items_json = fast_json.dumps(items).decode('utf-8')
+        
+        spliced = fast_json.dumps_with_raw(payload, items=items_json)
+        
+        assert fast_json.loads(spliced) == fast_json.loads(fast_json.dumps({**payload, 'items': items}))
+        assert spliced == fast_json.dumps({'items': items, **payload})
+        assert fast_json.dumps_with_raw({}, items='[]') == fast_json.dumps({'items': []})
+
+
+class TestProductMatcher:
+    """Test fuzzy product matching (token overlap path, without rapidfuzz)"""
+    
+    @pytest.fixture(autouse=True)
+    def no_rapidfuzz(self, monkeypatch):
+        from src import product_matcher
+        
+        monkeypatch.setattr(product_matcher, 'RAPIDFUZZ_AVAILABLE', False)
+        product_matcher._match_cached.cache_clear()
+        yield
+        product_matcher._match_cached.cache_clear()
+    
+    def test_match_product(self):
+        """Test that receipt names match after normalizing case, spaces and punctuation"""
+        from src.product_matcher import match_product
+        
+        assert match_product('  COLA   500ml!! ') == {'product_id': 'SKU001', 'matched_name': 'Cola 500ml'}
+        assert match_product('Bread White') == {'product_id': 'SKU003', 'matched_name': 'White Bread'}
+        assert match_product('Sugar') is None
+        assert match_product('') is None
+        assert match_product('!!!') is None
+    
+    def test_match_product_threshold(self):
+        """Test the threshold cutoff and the catalog-order tie-break"""
+        from src.product_matcher import match_product
+        
+        # Half the tokens of both 'Cola 500ml' and 'White Bread': the earlier entry wins
+        assert match_product('cola bread')['product_id'] == 'SKU001'
+        assert match_product('cola bread', threshold=0.6) is None
+        assert match_product('milk carton', threshold=0.5)['product_id'] == 'SKU004'
+        assert match_product('milk carton', threshold=0.75) is None
+    
+    def test_match_cached(self):
+        """Test that repeated names are answered from the cache"""
+        from src import product_matcher
+        
+        product_matcher.match_product('Bottled Water')
+        product_matcher.match_product('bottled  water!')
+        
+        info = product_matcher._match_cached.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+        assert product_matcher._TOKEN_INDEX['water'] == [1]
+    
+    def test_match_items(self):
+        """Test that match_items annotates matches, keeps other fields and passes threshold through"""
+        from src.product_matcher import match_items
+        
+        items = [
+            {'name': 'Milk 1L', 'quantity': 2, 'total': 1000},
+            {'name': 'Batteries', 'quantity': 1, 'total': 500},
+            {'name': 'cola bread', 'quantity': 1, 'total': 300},
+        ]
+        
+        matched = match_items(items)
+        strict = match_items(items, threshold=0.6)
+        
+        assert matched[0] == {'name': 'Milk 1L', 'quantity': 2, 'total': 1000,
+                              'product_id': 'SKU004', 'matched_name': 'Milk 1L'}
+        assert matched[1] == items[1]
+        assert matched[2]['product_id'] == 'SKU001'
+        assert strict[2] == items[2]
+        assert 'product_id' not in items[0]
+
+
+class TestLogging:
+    """Test the log formatter's cached timestamps"""
+    
+    @pytest.mark.parametrize('datefmt', [None, '%Y-%m-%d %H:%M:%S'])
+    def test_cached_time_matches_stdlib(self, datefmt):
+        """Test that cached asctime matches logging.Formatter, msecs included without a datefmt"""
+        import logging
+        from src.logging_config import CachedTimeFormatter
+        
+        cached = CachedTimeFormatter('{asctime} {message}', datefmt=datefmt, style='{')
+        stdlib = logging.Formatter('{asctime} {message}', datefmt=datefmt, style='{')
+        records = []
+        for created in (1760500000.125, 1760500000.875, 1760500001.5):
+            record = logging.LogRecord('test', logging.INFO, __file__, 1, 'hello', None, None)
+            record.created, record.msecs = created, (created - int(created)) * 1000
+            records.append(record)
+        
+        assert [cached.format(record) for record in records] == [stdlib.format(record) for record in records]
+        assert len({cached.format(record) for record in records}) == (3 if datefmt is None else 2)
+
+
+class TestPOSAgent:
+    """Test the agent's sync path and web UI handler"""
+    
+    @pytest.fixture
+    def agent(self, monkeypatch):
+        """Agent on an in-memory buffer with the stub backup API client"""
+        import main
+        
+        monkeypatch.setattr(main, '_load_config', lambda: {'db_path': ':memory:'})
+        agent = main.POSAgent()
+        yield agent
+        agent.buffer.close()
+    
+    def test_sync_chunk_partial_batch_failure(self, agent):
+        """Test that a partly failed batch marks confirmed receipts synced and resends only the rest"""
+        from src.escpos_parser import Transaction
+        
+        class BatchClient:
+            def __init__(self):
+                self.single = []
+            
+            def sync_batch(self, transactions, items_jsons=None):
+                return {'success': True, 'synced': 1, 'failed': 1,
+                        'results': {'RCT001': True, 'RCT002': False}}
+            
+            def sync_transaction(self, transaction, items_json=None):
+                self.single.append(transaction['receipt_id'])
+                return {'success': False, 'error': 'Server error 503', 'retry': True}
+        
+        agent.sync_client = BatchClient()
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = agent.buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100)])
+        chunk = [(tx_id, Transaction(receipt_id=receipt_id, total=100), '[]')
+                 for tx_id, receipt_id in zip(tx_ids, ['RCT001', 'RCT002'])]
+        
+        synced = agent._sync_chunk(chunk)
+        
+        assert synced == [(tx_ids[0], 200)]
+        assert agent.sync_client.single == ['RCT002']
+    
+    def test_retry_pending_sync(self, agent):
+        """Test that the pending retry backs off failures, dead-letters rejections and skips exhausted rows"""
+        class RawClient:
+            def __init__(self):
+                self.sent = []
+            
+            def sync_transaction_raw(self, body, receipt_id=None):
+                self.sent.append(receipt_id)
+                if receipt_id == 'RCT001':
+                    return {'success': True, 'status_code': 201}
+                if receipt_id == 'RCT002':
+                    return {'success': False, 'error': 'Server error 503', 'status_code': 503, 'retry': True}
+                if receipt_id == 'RCT005':
+                    # A local failure, even one flagged final, is not the server's verdict
+                    return {'success': False, 'error': 'bad response', 'retry': False}
+                return {'success': False, 'error': 'invalid total', 'status_code': 422, 'retry': False}
+        
+        agent.sync_client = RawClient()
+        buffer = agent.buffer
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        tx_ids = buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100),
+                                          ('RCT003', items, 100), ('RCT004', items, 100),
+                                          ('RCT005', items, 100)])
+        buffer._conn.execute("UPDATE pending_sync SET next_retry = '2000-01-01T00:00:00'")
+        buffer._conn.execute('UPDATE pending_sync SET retry_count = ? WHERE transaction_id = ?',
+                             (buffer.MAX_SYNC_RETRIES, tx_ids[3]))
+        buffer._conn.commit()
+        
+        agent._retry_pending_sync()
+        
+        assert agent.sync_client.sent == ['RCT001', 'RCT002', 'RCT003', 'RCT005']
+        pending = {row['transaction_id']: row['retry_count'] for row in buffer._conn.execute('SELECT * FROM pending_sync')}
+        assert pending == {tx_ids[1]: 1, tx_ids[2]: buffer.MAX_SYNC_RETRIES, tx_ids[3]: buffer.MAX_SYNC_RETRIES, tx_ids[4]: 1}
+        assert sorted(tx['receipt_id'] for tx in buffer.get_unsynced()) == ['RCT002', 'RCT004', 'RCT005']
+        
+        # Nothing is due again: RCT002 is backed off, the other two are out of retries
+        agent.sync_client.sent = []
+        buffer._conn.execute("UPDATE pending_sync SET next_retry = '2000-01-01T00:00:00' WHERE transaction_id NOT IN (?, ?)",
+                             (tx_ids[1], tx_ids[4]))
+        buffer._conn.commit()
+        agent._retry_pending_sync()
+        
+        assert agent.sync_client.sent == []
+    
+    def test_flush_batch_recovers_from_failed_write(self, agent, monkeypatch):
+        """Test that a failed write is rolled back before retrying, leaving no duplicates"""
+        import sqlite3
+        from src.escpos_parser import Transaction
+        
+        buffer = agent.buffer
+        insert = buffer._insert_transaction
+        failures = {'RCT002': 2}  # fails the batch, then the first single attempt
+        
+        def flaky_insert(cursor, receipt_id, *args):
+            tx_id = insert(cursor, receipt_id, *args)
+            if failures.get(receipt_id):
+                failures[receipt_id] -= 1
+                raise sqlite3.OperationalError('database is locked')
+            return tx_id
+        
+        monkeypatch.setattr(buffer, '_insert_transaction', flaky_insert)
+        agent._flush_batch([Transaction(receipt_id='RCT001', total=100), Transaction(receipt_id='RCT002', total=200)])
+        agent._flush_batch([Transaction(receipt_id='RCT003', total=300)])
+        
+        assert sorted(tx['receipt_id'] for tx in buffer.get_unsynced()) == ['RCT001', 'RCT002', 'RCT003']
+        assert buffer.get_stats()['pending_sync_queue'] == 3
+        assert not buffer._conn.in_transaction
+
+    def test_restart_does_not_replay_again(self, agent, monkeypatch):
+        """Test that moving to a new port sends each unsynced receipt only once"""
+        import src.printer_interceptor
+        
+        class FakeInterceptor:
+            def __init__(self, on_data_callback):
+                self.port = None
+            
+            def start_network(self, host, port):
+                self.port = port
+            
+            def stop(self):
+                pass
+        
+        class CountingClient:
+            def __init__(self):
+                self.sent = []
+            
+            def sync_transaction(self, transaction, items_json=None):
+                self.sent.append(transaction['receipt_id'])
+                return {'success': False, 'error': 'Server error 503', 'status_code': 503, 'retry': True}
+            
+            def sync_transaction_raw(self, body, receipt_id=None):
+                self.sent.append(receipt_id)
+                return {'success': False, 'error': 'Server error 503', 'status_code': 503, 'retry': True}
+        
+        monkeypatch.setattr(src.printer_interceptor, 'PrinterInterceptor', FakeInterceptor)
+        agent.sync_client = agent.recovery.sync_client = CountingClient()
+        items = [{'name': 'Test', 'quantity': 1, 'unit_price': 100, 'total': 100}]
+        agent.buffer.add_transactions([('RCT001', items, 100), ('RCT002', items, 100)])
+        
+        agent.start(9101)
+        agent.restart(9102)
+        agent.stop()
+        
+        assert sorted(agent.sync_client.sent) == ['RCT001', 'RCT002']
+        assert agent.interceptor.port == 9102
+        assert agent.running is False
+
+    def test_http_handler(self, agent):
+        """Test /status ETag revalidation, gzip for the UI page and 404 for unknown paths"""
+        import functools
+        import gzip
+        import http.client
+        import json
+        import threading
+        import main
+        
+        server = main.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(main.Handler, agent=agent))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        
+        def get(path, headers=None):
+            conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, dict(response.getheaders()), response.read()
+            finally:
+                conn.close()
+        
+        try:
+            status, headers, body = get('/status')
+            revalidated = get('/status', {'If-None-Match': headers['ETag']})
+            stale = get('/status', {'If-None-Match': '"0000"'})
+            page = get('/', {'Accept-Encoding': 'gzip, deflate'})
+            plain = get('/')
+            missing = get('/nope?x=1')
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        assert status == 200
+        assert json.loads(body)['stats']['total_transactions'] == 0
+        assert headers['Cache-Control'] == 'no-cache'
+        assert revalidated[0] == 304
+        assert revalidated[1]['ETag'] == headers['ETag']
+        assert revalidated[2] == b''
+        assert stale[0] == 200 and stale[2] == body
+        assert page[0] == 200
+        assert page[1]['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(page[2]) == main.HTML_BYTES
+        assert 'Content-Encoding' not in plain[1]
+        assert plain[2] == main.HTML_BYTES
+        assert missing[0] == 404
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])